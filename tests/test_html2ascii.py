@@ -0,0 +1,70 @@
+""" Conversions that should give the same text whichever way they are done, and the markers written when a page is too big """
+
+import unittest
+from uitext.ascii import html2ascii
+
+
+def make_page(body):
+    return "<html><body>" + body + "</body></html>"
+
+def make_table(rowCount, changedRow=None):
+    rows = [ "<tr><td>" + ("changed" if i == changedRow else "row " + str(i)) + "</td><td><b>x</b></td></tr>" for i in range(rowCount) ]
+    return "<table><tr><th>Name</th><th>Value</th></tr>" + "".join(rows) + "</table>"
+
+def make_options(count):
+    return "<select>" + "".join(( "<option>option " + str(i) + "</option>" for i in range(count) )) + "</select>"
+
+
+class IncrementalParserTest(unittest.TestCase):
+    pages = [
+        make_page("<h1>Start</h1><div class='menu'><a href='x'>Home</a></div>" + make_table(5)),
+        make_page("<h1>Start</h1><div class='menu'><a href='x'>Home</a></div>" + make_table(5, changedRow=2)),
+        make_page("<h1>Start</h1><div class='menu' style='display:none'><a href='x'>Home</a></div>" + make_table(5, changedRow=2)),
+        make_page("<h1>Next</h1><div class='menu'><a href='x'>Home</a><a href='y'>Away</a></div>" + make_table(6)),
+        make_page("<h1>Next</h1><div class='menu'><a href='x'>Home</a><a href='y'>Away</a></div><p>Done</p>" + make_options(3)),
+    ]
+
+    def check_same_as_convert(self, options):
+        parser = html2ascii.IncrementalParser(options)
+        for page in self.pages:
+            parser.reset()
+            self.assertEqual(parser.render(html2ascii.parse_document(page)), html2ascii.convert(page, options))
+
+    def test_default_options(self):
+        self.check_same_as_convert(html2ascii.Options())
+
+    def test_ignored_and_invisible(self):
+        self.check_same_as_convert(html2ascii.Options(toIgnore={ "menu" }, show_invisible=True))
+
+    def test_budget(self):
+        self.check_same_as_convert(html2ascii.Options(budget=html2ascii.Budget(maxTableRows=3, maxOptions=2, maxTextLength=4)))
+
+
+class BudgetTest(unittest.TestCase):
+    def convert(self, body, **limits):
+        return html2ascii.convert(make_page(body), html2ascii.Options(budget=html2ascii.Budget(**limits)))
+
+    def test_max_table_rows(self):
+        # the header row counts as one of the rows
+        text = self.convert(make_table(10), maxTableRows=3)
+        self.assertIn("row 1", text)
+        self.assertNotIn("row 2", text)
+        self.assertTrue(text.endswith("\n... 8 more rows\n"), text)
+
+    def test_max_table_rows_not_reached(self):
+        self.assertNotIn("more rows", self.convert(make_table(2), maxTableRows=3))
+
+    def test_max_options(self):
+        self.assertIn("(option 0, option 1, ... 8 more options)", self.convert(make_options(10), maxOptions=2))
+
+    def test_max_text_length(self):
+        self.assertIn("xxxxxxxxxx ... 40 more characters\n", self.convert("<p>" + "x" * 50 + "</p>", maxTextLength=10))
+
+    def test_max_output(self):
+        text = self.convert("".join(( "<p>paragraph " + str(i) + "</p>" for i in range(50) )), maxOutput=40)
+        self.assertTrue(text.endswith("\n... output truncated at 40 characters\n"), text)
+        self.assertNotIn("paragraph 10", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
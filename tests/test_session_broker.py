@@ -0,0 +1,169 @@
+""" Leasing warm browser sessions, with fake drivers standing in for Chrome, and making a leased browser look new """
+
+import os, socket, tempfile, threading, unittest
+from uitext.selenium import session_broker
+
+
+class FakeService:
+    service_url = "http://127.0.0.1:9515"
+
+
+class FakeDriver:
+    count = 0
+
+    def __init__(self):
+        FakeDriver.count += 1
+        self.session_id = "session" + str(FakeDriver.count)
+        self.service = FakeService()
+        self.healthy = True
+        self.quitted = False
+
+    def execute_script(self, script):
+        if not self.healthy:
+            raise OSError("browser has gone")
+        return 1
+
+    def quit(self):
+        self.quitted = True
+
+
+class SessionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = session_broker.SessionPool(FakeDriver, size=2, maxUses=2)
+        self.pool.fill()
+
+    def test_fill(self):
+        self.assertEqual(self.pool.get_status(), { "idle": 2, "leased": 0, "starting": 0 })
+        self.assertFalse(self.pool.needs_filling())
+
+    def test_lease_and_release(self):
+        leaseId, driver = self.pool.lease(os.getpid())
+        self.assertEqual(self.pool.get_status(), { "idle": 1, "leased": 1, "starting": 0 })
+        self.assertTrue(self.pool.release(leaseId))
+        self.assertFalse(self.pool.release(leaseId))
+        self.assertEqual(self.pool.get_status(), { "idle": 2, "leased": 0, "starting": 0 })
+        self.assertFalse(driver.quitted)
+
+    def test_nothing_idle(self):
+        self.pool.lease()
+        self.pool.lease()
+        self.assertIsNone(self.pool.lease())
+
+    def test_unhealthy_session_not_leased(self):
+        self.pool.idle[0].driver.healthy = False
+        broken = self.pool.idle[0].driver
+        leaseId, driver = self.pool.lease()
+        self.assertIsNot(driver, broken)
+        self.assertTrue(broken.quitted)
+        self.assertTrue(self.pool.needs_filling())
+
+    def test_quit_after_max_uses(self):
+        for _ in range(2):
+            leaseId, driver = self.pool.lease()
+            self.pool.release(leaseId)
+            self.pool.idle.insert(0, self.pool.idle.pop()) # lease the same one again
+        self.assertTrue(driver.quitted)
+        self.assertEqual(self.pool.get_status(), { "idle": 1, "leased": 0, "starting": 0 })
+
+    def test_close(self):
+        leaseId, driver = self.pool.lease()
+        self.pool.close()
+        self.assertTrue(driver.quitted)
+        self.assertFalse(self.pool.needs_filling())
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs Unix sockets")
+class SessionBrokerTest(unittest.TestCase):
+    def setUp(self):
+        self.socketPath = os.path.join(tempfile.mkdtemp(), "sessions.sock")
+        pool = session_broker.SessionPool(FakeDriver, size=1)
+        pool.fill()
+        self.broker = session_broker.SessionBroker(self.socketPath, pool, config={ "lang": "en" })
+        self.thread = threading.Thread(target=self.broker.serve_forever, kwargs={ "poll_interval": 0.05 }, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.broker.shutdown()
+        self.broker.server_close()
+        os.remove(self.socketPath)
+        os.rmdir(os.path.dirname(self.socketPath))
+
+    def test_lease_and_release(self):
+        lease = session_broker.lease_session(self.socketPath, config={ "lang": "en" })
+        self.assertEqual(lease["url"], FakeService.service_url)
+        self.assertIsNone(session_broker.lease_session(self.socketPath))
+        session_broker.release_session(lease["lease"], self.socketPath)
+        self.assertEqual(session_broker.lease_session(self.socketPath)["session"], lease["session"])
+
+    def test_other_config(self):
+        self.assertIsNone(session_broker.lease_session(self.socketPath, config={ "lang": "sv" }))
+
+    def test_no_broker(self):
+        self.assertIsNone(session_broker.lease_session(self.socketPath + ".missing"))
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle):
+        self.driver.current_window_handle = handle
+
+    def new_window(self, kind):
+        handle = "tab" + str(len(self.driver.openHandles) + len(self.driver.closedHandles) + 1)
+        self.driver.openHandles.append(handle)
+        self.driver.current_window_handle = handle
+
+
+class FakeLeasedDriver:
+    """ A browser left behind by another test, with two tabs, cookies and history """
+    def __init__(self):
+        self.openHandles = [ "tab1", "tab2" ]
+        self.closedHandles = []
+        self.current_window_handle = "tab1"
+        self.switch_to = FakeSwitchTo(self)
+        self.commands = []
+        self.history = { "tab1": [ "https://login.example.com/", "https://app.example.com/start" ], "tab2": [ "about:blank", "http://other.example.org/" ] }
+
+    @property
+    def window_handles(self):
+        return list(self.openHandles)
+
+    def close(self):
+        self.openHandles.remove(self.current_window_handle)
+        self.closedHandles.append(self.current_window_handle)
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        self.commands.append((cmd, cmd_args))
+        if cmd == "Page.getNavigationHistory":
+            return { "entries": [ { "url": url } for url in self.history[self.current_window_handle] ] }
+        elif cmd == "Page.getFrameTree":
+            return { "frameTree": { "frame": { "url": "about:blank" }, "childFrames": [ { "frame": { "url": "https://ads.example.net/frame" } } ] } }
+        elif cmd == "Network.getAllCookies":
+            return { "cookies": [ { "domain": ".cookies.example.com" } ] }
+        return {}
+
+
+class ResetLeasedDriverTest(unittest.TestCase):
+    def setUp(self):
+        from uitext.selenium import selenium_utils
+        self.session = selenium_utils.Session()
+        self.session.driver = FakeLeasedDriver()
+        self.session._reset_leased_driver("https://app.example.com/start")
+
+    def test_new_tab(self):
+        driver = self.session.driver
+        self.assertEqual(driver.closedHandles, [ "tab1", "tab2" ])
+        self.assertEqual(driver.window_handles, [ driver.current_window_handle ])
+
+    def test_data_cleared(self):
+        commands = [ cmd for cmd, args in self.session.driver.commands ]
+        self.assertIn("Network.clearBrowserCookies", commands)
+        self.assertIn("Browser.resetPermissions", commands)
+        cleared = [ args["origin"] for cmd, args in self.session.driver.commands if cmd == "Storage.clearDataForOrigin" ]
+        self.assertEqual(cleared, sorted([ "https://app.example.com", "https://login.example.com", "http://other.example.org", "https://ads.example.net",
+                                           "https://cookies.example.com", "http://cookies.example.com" ]))
+
+
+if __name__ == "__main__":
+    unittest.main()
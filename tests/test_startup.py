@@ -0,0 +1,37 @@
+""" The console scripts are started many times per test run, so importing them shouldn't pull in the heavy
+    packages that only some uses need. Checked with python -X importtime, as for investigating start-up time """
+
+import os, sys, subprocess, unittest
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def get_imported_modules(moduleName):
+    # -c puts the current directory first on sys.path, so this finds the package in this tree
+    proc = subprocess.run([ sys.executable, "-X", "importtime", "-c", "import " + moduleName ],
+                          cwd=repoDir, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    # lines look like "import time:  self [us] | cumulative | imported package"
+    return [ line.rsplit("|", 1)[-1].strip() for line in proc.stderr.splitlines() if line.startswith("import time:") ]
+
+def get_top_packages(moduleNames):
+    return set((name.split(".")[0] for name in moduleNames))
+
+
+class StartupImportTest(unittest.TestCase):
+    heavyPackages = { "selenium", "openpyxl" }
+
+    def check_startup_imports(self, moduleName):
+        imported = get_top_packages(get_imported_modules(moduleName))
+        self.assertEqual(imported & self.heavyPackages, set(), "importing " + moduleName + " should not import these")
+
+    def test_html2ascii(self):
+        self.check_startup_imports("uitext.ascii.html2ascii")
+
+    def test_xlsx2ascii(self):
+        self.check_startup_imports("uitext.ascii.xlsx2ascii")
+
+    def test_html2ascii_client(self):
+        self.check_startup_imports("uitext.ascii.html2ascii_client")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,2 +1,7 @@
 
-from .selenium import selenium_utils
\ No newline at end of file
+def __getattr__(name):
+    # selenium takes a long time to import, and html2ascii and xlsx2ascii don't need it
+    if name == "selenium_utils":
+        from .selenium import selenium_utils
+        return selenium_utils
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
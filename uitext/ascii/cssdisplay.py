@@ -0,0 +1,217 @@
+""" Module for working out the CSS display property of elements from a page's own <style> elements, without a browser.
+Only simple selectors are understood: tags, classes, ids and attributes, in any combination, but no combinators or pseudo-classes.
+Linked stylesheets are not available, and rules only affect elements after the <style> element that defines them.
+Rules in @media apply if the media query matches a screen of USECASE_SCREEN_SIZE, as far as width, height and orientation can tell """
+
+import os, re
+
+compound_selector_pattern = re.compile(r"^(?:[a-zA-Z][\w-]*|\*)?(?:[#.][\w-]+|\[[^\]]+\])*$")
+selector_part_pattern = re.compile(r"""^([a-zA-Z][\w-]*|\*)|([#.])([\w-]+)|\[\s*([\w-]+)\s*(?:([~|^$*]?=)\s*(?:"([^"]*)"|'([^']*)'|([^\]\s]*))\s*)?\]""")
+comment_pattern = re.compile(r"/\*.*?\*/", re.DOTALL)
+# At-rules whose contents are ordinary rules, apart from @media which depends on its query.
+# Others, like @keyframes, @font-face and @container, whose size we can't know, are skipped
+nested_rule_at_rules = ("@supports", "@layer", "@document")
+media_feature_pattern = re.compile(r"\(\s*(min-|max-)?(width|height)\s*:\s*([\d.]+)(px|em|rem)?\s*\)$")
+orientation_pattern = re.compile(r"\(\s*orientation\s*:\s*(landscape|portrait)\s*\)$")
+
+def get_screen_size():
+    # the size selenium_utils gives the browser
+    try:
+        width, height = os.getenv("USECASE_SCREEN_SIZE", "1920,1080").split(",")
+        return int(width), int(height)
+    except ValueError:
+        return 1920, 1080
+
+def media_matches(mediaQueryList, screenSize):
+    return any((media_query_matches(query.strip().lower(), screenSize) for query in mediaQueryList.split(",")))
+
+def media_query_matches(query, screenSize):
+    # Queries we can't evaluate don't match, as most of those are for printing or other devices
+    if not query:
+        return True
+    parts = [ part.strip() for part in re.split(r"\band\b", query) ]
+    negate = False
+    if not parts[0].startswith("("):
+        words = parts.pop(0).split()
+        if words and words[0] in ("not", "only"):
+            negate = words.pop(0) == "not"
+        if len(words) != 1:
+            return False
+        if words[0] not in ("all", "screen"):
+            return negate
+    for part in parts:
+        matches = media_feature_matches(part, screenSize)
+        if matches is None:
+            return False
+        elif not matches:
+            return negate
+    return not negate
+
+def media_feature_matches(feature, screenSize):
+    width, height = screenSize
+    match = media_feature_pattern.match(feature)
+    if match:
+        prefix, dimension, value, unit = match.groups()
+        limit = float(value) * (16 if unit in ("em", "rem") else 1)
+        actual = width if dimension == "width" else height
+        if prefix == "min-":
+            return actual >= limit
+        elif prefix == "max-":
+            return actual <= limit
+        else:
+            return actual == limit
+    match = orientation_pattern.match(feature)
+    if match:
+        return (match.group(1) == "landscape") == (width >= height)
+
+def is_explicit_display(name, display):
+    # The same choice as selenium_utils.make_display_explicit, so a page looks the same whichever way its display was found
+    return (display in ("flex", "inline-block") and name != "span") or \
+        (display == "block" and name != "div") or \
+        (display == "none" and name not in ("script", "style", "head", "meta", "title", "base", "link"))
+
+def attribute_matches(actual, op, expected):
+    if actual is None:
+        return False
+    if op is None:
+        return True
+    elif op == "=":
+        return actual == expected
+    elif op == "~=":
+        return expected in actual.split()
+    elif op == "|=":
+        return actual == expected or actual.startswith(expected + "-")
+    elif op == "^=":
+        return bool(expected) and actual.startswith(expected)
+    elif op == "$=":
+        return bool(expected) and actual.endswith(expected)
+    else:
+        return bool(expected) and expected in actual
+
+
+class DisplayRule:
+    def __init__(self, tag, ids, classes, attrSelectors, display, important, order):
+        self.tag = tag
+        self.ids = ids
+        self.classes = classes
+        self.attrSelectors = attrSelectors
+        self.display = display
+        # which rule wins, when several match
+        self.priority = important, len(ids), len(classes) + len(attrSelectors), 1 if tag else 0, order
+
+    def matches(self, name, elementId, elementClasses, attrDict):
+        return (self.tag is None or self.tag == name) and \
+            all((id == elementId for id in self.ids)) and \
+            elementClasses.issuperset(self.classes) and \
+            all((attribute_matches(attrDict.get(attr), op, value) for attr, op, value in self.attrSelectors))
+
+
+class DisplayRules:
+    def __init__(self, screenSize=None):
+        self.screenSize = screenSize or get_screen_size()
+        self.rulesById = {}
+        self.rulesByClass = {}
+        self.rulesByTag = {}
+        self.otherRules = []
+        self.ruleCount = 0
+        # identifies the stylesheets seen so far
+        self.fingerprint = None
+
+    def add_stylesheet(self, text):
+        self.fingerprint = hash((self.fingerprint, text))
+        for prelude, block in self.iter_rules(comment_pattern.sub("", text)):
+            display, important = self.find_display(block)
+            if display:
+                for selector in prelude.split(","):
+                    self.add_rule(selector.strip(), display, important)
+
+    def iter_rules(self, text):
+        pos = 0
+        while True:
+            blockStart = text.find("{", pos)
+            if blockStart == -1:
+                return
+            prelude = text[pos:blockStart]
+            if ";" in prelude: # statements like @import and @charset
+                prelude = prelude.rsplit(";", 1)[-1]
+            prelude = prelude.strip()
+            if prelude.startswith("@"):
+                blockEnd = self.find_block_end(text, blockStart)
+                if prelude.startswith(nested_rule_at_rules) or \
+                    (prelude.startswith("@media") and media_matches(prelude[len("@media"):], self.screenSize)):
+                    yield from self.iter_rules(text[blockStart + 1:blockEnd])
+            else:
+                blockEnd = text.find("}", blockStart)
+                if blockEnd == -1:
+                    blockEnd = len(text)
+                yield prelude, text[blockStart + 1:blockEnd]
+            pos = blockEnd + 1
+
+    def find_block_end(self, text, blockStart):
+        depth = 0
+        for pos in range(blockStart, len(text)):
+            if text[pos] == "{":
+                depth += 1
+            elif text[pos] == "}":
+                depth -= 1
+                if depth == 0:
+                    return pos
+        return len(text)
+
+    def find_display(self, block):
+        display, important = None, False
+        for part in block.split(";"):
+            if ":" in part:
+                key, value = part.split(":", 1)
+                if key.strip().lower() == "display":
+                    value = value.strip().lower()
+                    currImportant = value.endswith("!important")
+                    if currImportant or not important: # later declarations win, unless the earlier one is important
+                        display = value.replace("!important", "").strip()
+                        important = currImportant
+        return display, important
+
+    def add_rule(self, selector, display, important):
+        if not selector or not compound_selector_pattern.match(selector):
+            return
+        tag, ids, classes, attrSelectors = None, [], set(), []
+        for match in selector_part_pattern.finditer(selector):
+            tagName, prefix, ident, attr, op, value1, value2, value3 = match.groups()
+            if tagName:
+                tag = None if tagName == "*" else tagName.lower()
+            elif prefix == "#":
+                ids.append(ident)
+            elif prefix == ".":
+                classes.add(ident)
+            else:
+                value = next((v for v in (value1, value2, value3) if v is not None), None)
+                attrSelectors.append((attr.lower(), op, value))
+        self.ruleCount += 1
+        rule = DisplayRule(tag, ids, classes, attrSelectors, display, important, self.ruleCount)
+        if ids:
+            self.rulesById.setdefault(ids[0], []).append(rule)
+        elif classes:
+            self.rulesByClass.setdefault(next(iter(classes)), []).append(rule)
+        elif tag:
+            self.rulesByTag.setdefault(tag, []).append(rule)
+        else:
+            self.otherRules.append(rule)
+
+    def get_display(self, name, attrs):
+        if not self.ruleCount:
+            return None
+        attrDict = dict(attrs)
+        elementId = attrDict.get("id")
+        cls = attrDict.get("class")
+        elementClasses = set(cls.split()) if cls else set()
+        candidates = self.rulesByTag.get(name, []) + self.otherRules
+        if elementId is not None:
+            candidates += self.rulesById.get(elementId, [])
+        for elementClass in elementClasses:
+            candidates += self.rulesByClass.get(elementClass, [])
+        best = None
+        for rule in candidates:
+            if (best is None or rule.priority > best.priority) and rule.matches(name, elementId, elementClasses, attrDict):
+                best = rule
+        if best is not None:
+            return best.display
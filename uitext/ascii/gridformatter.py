@@ -71,14 +71,19 @@ class GridFormatter:
         return desc.rstrip()
 
     def formatCellsInGrid(self, colWidths):
-        lines = []
+        return "\n".join(self.getCellLines(colWidths))
+
+    def getCellLines(self, colWidths, lines=None):
+        # Adds to lines if given, so the caller can join everything once instead of copying large grids around
+        if lines is None:
+            lines = []
         for row in self.grid:
             rowLines = max((desc.count("\n") + 1 for desc in row))
+            rowCellLines = [ desc.splitlines() for desc in row ]
             for rowLine in range(rowLines):
                 lineText = ""
                 currPos = 0
-                for colNum, childDesc in enumerate(row):
-                    cellLines = childDesc.splitlines()
+                for colNum, cellLines in enumerate(rowCellLines):
                     if rowLine < len(cellLines):
                         cellRow = cellLines[rowLine]
                     else:
@@ -88,7 +93,7 @@ class GridFormatter:
                     lineText += cellRow.ljust(colWidths[colNum])
                     currPos += colWidths[colNum]
                 lines.append(lineText.rstrip(" ")) # don't leave trailing spaces
-        return "\n".join(lines)
+        return lines
     
 class GridFormatterWithHeader:
     def __init__(self, headerRows, rows, columnCount, minWidths={}, allowHeaderOverlap=False):
@@ -101,13 +106,15 @@ class GridFormatterWithHeader:
     def __str__(self):
         colWidths = GridFormatter(self.headerRows + self.rows, self.columnCount, allowOverlap=self.allowHeaderOverlap).findColumnWidths()
         self.adjustForMinFieldWidths(colWidths)
-        header = GridFormatter(self.headerRows, self.columnCount).formatCellsInGrid(colWidths)
-        line = "_" * sum(colWidths) + "\n"
+        line = "_" * sum(colWidths)
+        lines = [ line ]
+        GridFormatter(self.headerRows, self.columnCount).getCellLines(colWidths, lines)
+        lines.append(line)
         if len(self.rows) > 0:
-            body = GridFormatter(self.rows, self.columnCount).formatCellsInGrid(colWidths)
-            return self.formatWithSeparators(header, body, line)
-        else:
-            return line + header + "\n" + line
+            GridFormatter(self.rows, self.columnCount).getCellLines(colWidths, lines)
+            lines.append(line)
+        lines.append("")
+        return "\n".join(lines)
 
     def adjustForMinFieldWidths(self, colWidths):
         for i, columnName in enumerate(self.headerRows[0]):
@@ -120,8 +127,4 @@ class GridFormatterWithHeader:
             return self.minFieldWidths[columnName]
         elif "(" in columnName:
             return self.minFieldWidths.get(columnName.split("(")[0])
-        
-    @staticmethod
-    def formatWithSeparators(header, body, line):
-        return line + header + "\n" + line + body + "\n" + line
 
@@ -2,13 +2,14 @@
 
 """ Utility for UI testing - convert an HTML dump to an ASCII screenshot"""
 
-import sys, os
+import sys, os, re, time
 from html.parser import HTMLParser
 from .gridformatter import GridFormatter, GridFormatterWithHeader
-from traceback import format_exception
-import argparse
+from .htmldocument import Document, parse_document, START, DATA, void_tags, subtree_tags
+from .cssdisplay import DisplayRules, is_explicit_display
 
 def getExceptionString():
+    from traceback import format_exception # only needed when things go wrong
     return "".join(format_exception(*sys.exc_info()))
 
 
@@ -32,17 +33,13 @@ def shouldAddWhitespace(text, existingText):
     else:
         return not lastChar.isspace()
     
-def quotes_matched_in_line(origText, quote_char):
-    pos = origText.rfind("\n") + 1
-    return origText[pos:].count(quote_char) % 2 == 0
-
 quote_chars = "'*"
 def find_quote(newChar, lastChar):
     for quote in quote_chars:
         if newChar == quote or lastChar == quote:
             return quote
 
-def adapt_spaces(text, origText):
+def adapt_spaces(text, origText, lineState):
     if len(origText) == 0 or len(text) == 0:
         return text
 
@@ -60,16 +57,143 @@ def adapt_spaces(text, origText):
     if not quote_char:
         return text
 
-    return " " + text if quotes_matched_in_line(origText, quote_char) else text
+    return " " + text if lineState.quotes_matched(origText, quote_char) else text
+
+multiple_spaces = re.compile("  +")
+
+class LineState:
+    """ Running count of the quote characters in the last line of some text that is only appended to,
+    so that adding a fragment doesn't mean rescanning the whole line. Call invalidate() if the text is changed in any other way """
+    def __init__(self):
+        self.invalidate()
+
+    def invalidate(self):
+        self.scannedLength = None
+
+    def sync(self, text):
+        if self.scannedLength is None or len(text) < self.scannedLength:
+            self.lineStart = text.rfind("\n") + 1
+            newText = text[self.lineStart:]
+            self.quoteCounts = dict.fromkeys(quote_chars, 0)
+        else:
+            newText = text[self.scannedLength:]
+            newLinePos = newText.rfind("\n")
+            if newLinePos != -1:
+                self.lineStart = self.scannedLength + newLinePos + 1
+                newText = newText[newLinePos + 1:]
+                self.quoteCounts = dict.fromkeys(quote_chars, 0)
+        for quote_char in quote_chars:
+            self.quoteCounts[quote_char] += newText.count(quote_char)
+        self.scannedLength = len(text)
+
+    def quotes_matched(self, text, quote_char):
+        self.sync(text)
+        return self.quoteCounts[quote_char] % 2 == 0
+
+    def get_line_start(self, text):
+        self.sync(text)
+        return self.lineStart
 
 
 class ModalAbort(Exception):
     pass
 
+class ScopeAbort(ModalAbort):
+    # The element chosen with Options.scope has been written, nothing more to do
+    pass
+
+class BudgetAbort(ModalAbort):
+    # A limit from Budget has been reached, the rest of the page is left out
+    pass
+
+def count_more(count, what):
+    return "... " + format(count, ",") + " more " + what
+
+class Budget:
+    """ Limits on how much work a single page can cause, so that pathological pages can't stall a test run.
+    Anything beyond a limit is left out and replaced by a marker saying how much is missing. None means no limit """
+    def __init__(self, maxOutput=None, maxTableRows=None, maxOptions=None, maxTextLength=None, timeLimit=None):
+        self.maxOutput = maxOutput # characters
+        self.maxTableRows = maxTableRows # header rows included
+        self.maxOptions = maxOptions
+        self.maxTextLength = maxTextLength # characters in a single piece of text
+        self.timeLimit = timeLimit # seconds
+
+
+# Font Awesome and Kendo icons, but not the Font Awesome classes that just say there is an icon or give its width
+icon_class_pattern = re.compile("k-i-|k-svg-i-|icon-|fa-(?!icon$|w-)")
+
+class Options:
+    """ Precomputed settings for converting HTML, which can be shared between any number of conversions.
+    Create them once and pass them to convert, rather than building parsers directly """
+    __slots__ = ("toIgnore", "iconProperties", "modalProperties", "show_invisible", "tagHandlers", "voidTags", "scope", "use_stylesheets", "budget", "collapse_repeats", "_parsers")
+    def __init__(self, toIgnore=(), iconProperties=(), modalProperties=(), show_invisible=False, tagHandlers=None, scope=None, use_stylesheets=False,
+                 budget=None, collapse_repeats=False):
+        init = object.__setattr__
+        init(self, "toIgnore", frozenset(toIgnore))
+        init(self, "iconProperties", frozenset(iconProperties))
+        init(self, "modalProperties", frozenset(modalProperties))
+        init(self, "show_invisible", show_invisible)
+        # Shared registry by default, so custom handlers registered with register_tag_handler apply everywhere
+        init(self, "tagHandlers", tag_handlers if tagHandlers is None else tagHandlers)
+        init(self, "voidTags", void_tags)
+        # (attribute, value) identifying the only element to write, e.g. ("data-test-id", "panel"). Matches any of the element's classes for "class"
+        init(self, "scope", scope)
+        # Work out display from the page's <style> elements, for pages captured without data-test-explicit-display
+        init(self, "use_stylesheets", use_stylesheets)
+        init(self, "budget", budget)
+        # Write sibling elements that look exactly the same once, with a repeat count
+        init(self, "collapse_repeats", collapse_repeats)
+        init(self, "_parsers", []) # idle parsers using these options, see convert
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Options cannot be changed once created")
+
+    def is_icon_property(self, prop):
+        return prop in self.iconProperties or icon_class_pattern.match(prop) is not None
+
+    def is_scope_element(self, attrs):
+        attr, value = self.scope
+        attrValue = get_attr_value(attrs, attr)
+        if attr == "class":
+            return attrValue is not None and value in attrValue.split()
+        else:
+            return attrValue == value
+
+
+# elements likely to be repeated many times in the same list or grid
+collapsible_tags = subtree_tags | frozenset([ "li" ])
+
+class RepeatRun:
+    # Sibling elements written identically, of which only the first is kept
+    def __init__(self, key, text, state, end, tail, earlierTextChanges, nextIx):
+        self.key = key # see get_repeat_key
+        self.text = text
+        self.state = state
+        self.end = end
+        self.tail = tail # last line of the text before end, the only part later elements can change
+        self.earlierTextChanges = earlierTextChanges
+        self.nextIx = nextIx # where the next sibling should start, if there is one
+        self.count = 1
+
+
 class HtmlExtractParser(HTMLParser):
-    voidTags = [ 'area', 'base', 'br', 'col', 'command', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'meta', 'param', 'source', 'track', 'wbr' ]
-    def __init__(self, toIgnore=set(), iconProperties=set(), modalProperties=set(), show_invisible=False):
+    voidTags = void_tags
+    def __init__(self, toIgnore=set(), iconProperties=set(), modalProperties=set(), show_invisible=False, tagHandlers=None, options=None):
+        if options is None:
+            options = Options(toIgnore, iconProperties, modalProperties, show_invisible, tagHandlers)
+        self.options = options
+        self.tagHandlers = options.tagHandlers
+        self.voidTags = options.voidTags
+        self.propertiesToIgnore = options.toIgnore
+        self.iconProperties = options.iconProperties
+        self.modalProperties = options.modalProperties
+        self.show_invisible = options.show_invisible
         HTMLParser.__init__(self)
+
+    def reset(self):
+        # Called by HTMLParser.__init__ too. Afterwards the parser can convert another document with the same options
+        HTMLParser.reset(self)
         self.currentSubParsers = []
         self.inBody = False
         self.inScript = False
@@ -77,23 +201,34 @@ class HtmlExtractParser(HTMLParser):
         self.inStyle = False
         self.linkStart = None
         self.text = ""
+        self.lineState = LineState()
         self.liLevel = 0
         self.level = 0
         self.modalDivLevel = None
         self.flexData = {}
         self.beforeDataText = ""
         self.afterDataText = ""
-        self.propertiesToIgnore = toIgnore
-        self.iconProperties = iconProperties
-        self.modalProperties = modalProperties
         self.sliderProperties = []
         self.ignoreUntilCloseTag = ""
         self.ignoreRecursionLevel = 0
-        self.show_invisible = show_invisible
+        self.outOfScope = self.options.scope is not None
+        self.scopeTag = None
+        self.scopeDepth = 0
+        self.displayRules = DisplayRules() if self.options.use_stylesheets else None
+        self.budget = self.options.budget
+        self.deadline = None
+        self.earlierTextChanges = 0
 
     def parse(self, text):
+        self.start_clock()
         try:
-            self.feed(text)
+            # shadow roots can only be flattened once the whole host has been read, and repeats need to know where elements end
+            if "shadowrootmode" in text or self.options.collapse_repeats:
+                self.replay(parse_document(text))
+            else:
+                self.feed(text)
+            if self.budget is not None:
+                self.check_budget()
         except ModalAbort:
             pass
         except:
@@ -103,6 +238,185 @@ class HtmlExtractParser(HTMLParser):
             sys.stderr.write(text + "\n")
         return self.text
 
+    def render(self, document):
+        # Same as parse, but for a page that has already been parsed into a Document
+        self.start_clock()
+        try:
+            self.replay(document)
+            if self.budget is not None:
+                self.check_budget()
+        except ModalAbort:
+            pass
+        except:
+            sys.stderr.write("Failed to render parsed browser text:\n")
+            sys.stderr.write(getExceptionString())
+        return self.text
+
+    def replay(self, document):
+        if self.options.collapse_repeats:
+            self.replay_collapsing_repeats(document)
+        else:
+            document.replay(self)
+
+    def replay_collapsing_repeats(self, document):
+        # Sibling elements written exactly like the one before are left out, and the text of the first is followed by a repeat count.
+        # If an element is also identical to the one before, with the parser in the same state, it isn't even written
+        events = document.events
+        subtrees = document.find_subtrees(collapsible_tags)
+        openSubtrees = []
+        runs = [ None ] # the current RepeatRun at each level of open subtrees
+        ix = 0
+        try:
+            while ix < len(events):
+                event = events[ix]
+                kind = event[0]
+                subtree = subtrees.get(ix)
+                run = runs[-1]
+                if subtree is not None:
+                    endIx, subtreeHash = subtree
+                    if run is not None and run.nextIx != ix:
+                        self.write_repeat_count(run)
+                        run = runs[-1] = None
+                    if self.is_self_contained():
+                        key = self.get_repeat_key(subtreeHash)
+                        if run is not None and run.key == key and len(self.text) == run.end:
+                            run.count += 1
+                            run.nextIx = endIx + 1
+                            ix = endIx + 1
+                            continue
+                        tailStart = self.get_context_start()
+                        openSubtrees.append((endIx, key, len(self.text), self.text[tailStart:], self.earlierTextChanges))
+                    else:
+                        openSubtrees.append((endIx, None, None, None, None))
+                    runs.append(None)
+                elif run is not None and not (kind == DATA and event[1].isspace()):
+                    self.write_repeat_count(run)
+                    runs[-1] = None
+
+                if kind == DATA:
+                    self.handle_data(event[1])
+                elif kind == START:
+                    self.handle_starttag(event[1], event[2])
+                else:
+                    self.handle_endtag(event[1])
+
+                if subtree is None and runs[-1] is not None:
+                    runs[-1].nextIx = ix + 1
+                if openSubtrees and openSubtrees[-1][0] == ix:
+                    runs.pop()
+                    runs[-1] = self.end_repeat_candidate(runs[-1], *openSubtrees.pop())
+                ix += 1
+        except ScopeAbort:
+            self.write_repeat_counts(runs)
+            raise
+        self.write_repeat_counts(runs)
+
+    def get_repeat_key(self, subtreeHash):
+        tailStart = self.get_context_start()
+        hasText = bool(self.text[tailStart:].strip() or self.text[:tailStart].strip())
+        return subtreeHash, self.text[tailStart:], hasText, self.get_state(), self.get_stylesheet_fingerprint()
+
+    def text_unchanged_since(self, pos, tail, earlierTextChanges):
+        return earlierTextChanges == self.earlierTextChanges and len(self.text) >= pos and self.text.startswith(tail, pos - len(tail))
+
+    def end_repeat_candidate(self, run, endIx, key, start, tail, earlierTextChanges):
+        # Returns the run that continues after this element. Only elements written on lines of their own are collapsed,
+        # as a repeat count in the middle of a line would be hard to tell apart from the text
+        text = self.text[start:]
+        if key is None or not self.is_self_contained() or not self.text_unchanged_since(start, tail, earlierTextChanges) or \
+            not (text.startswith("\n") or start == 0 or self.text[start - 1] == "\n"):
+            if run is not None:
+                self.write_repeat_count(run)
+            return None
+        state = self.get_state()
+        if run is not None and self.repeats_text(run.text, text) and run.state == state and self.text_unchanged_since(run.end, run.tail, run.earlierTextChanges):
+            self.text = self.text[:run.end]
+            self.lineState.invalidate()
+            run.count += 1
+            run.key = key
+            run.nextIx = endIx + 1
+            return run
+        if run is not None:
+            self.write_repeat_count(run)
+        tailStart = self.get_context_start()
+        return RepeatRun(key, text, state, len(self.text), self.text[tailStart:], self.earlierTextChanges, endIx + 1)
+
+    def repeats_text(self, runText, text):
+        # The first element of a run may also start with newlines separating it from the text before
+        return runText.endswith(text) and not runText[:-len(text)].strip("\n")
+
+    def write_repeat_count(self, run):
+        if run.count > 1 and self.text_unchanged_since(run.end, run.tail, run.earlierTextChanges):
+            # on its own line straight after the last line of the run, so it's clear where the run ends,
+            # indented like the run so that nested runs can be told apart
+            end = run.end - (len(run.text) - len(run.text.rstrip("\n")))
+            before, after = self.text[:end], self.text[end:]
+            firstLine = run.text.lstrip("\n").split("\n", 1)[0]
+            repeated = firstLine[:len(firstLine) - len(firstLine.lstrip(" "))] + "(repeated " + format(run.count, ",") + " times)"
+            if before and not before.endswith("\n"):
+                repeated = "\n" + repeated
+            self.text = before + repeated + (after if after.startswith("\n") else "\n" + after.lstrip(" "))
+            self.lineState.invalidate()
+
+    def write_repeat_counts(self, runs):
+        for run in reversed(runs):
+            if run is not None:
+                self.write_repeat_count(run)
+
+    def start_clock(self):
+        if self.budget is not None and self.budget.timeLimit is not None:
+            self.deadline = time.monotonic() + self.budget.timeLimit
+
+    def is_self_contained(self):
+        # Nothing refers to positions in the text written so far. Also compare earlierTextChanges before and after,
+        # as dialogs and unbalanced links change all the text before them
+        return not self.currentSubParsers and not self.flexData and self.linkStart is None
+
+    def get_state(self):
+        sliderProperties = tuple(((attr, frozenset(classes), cls) for attr, classes, cls in self.sliderProperties))
+        return self.inBody, self.inScript, self.inSuperscript, self.inStyle, self.liLevel, self.level, self.modalDivLevel, \
+            self.beforeDataText, self.afterDataText, self.ignoreUntilCloseTag, self.ignoreRecursionLevel, sliderProperties, \
+            self.outOfScope, self.scopeTag, self.scopeDepth
+
+    def set_state(self, state):
+        self.inBody, self.inScript, self.inSuperscript, self.inStyle, self.liLevel, self.level, self.modalDivLevel, \
+            self.beforeDataText, self.afterDataText, self.ignoreUntilCloseTag, self.ignoreRecursionLevel, sliderProperties, \
+            self.outOfScope, self.scopeTag, self.scopeDepth = state
+        self.sliderProperties = list(sliderProperties)
+
+    def get_stylesheet_fingerprint(self):
+        return self.displayRules.fingerprint if self.displayRules is not None else None
+
+    def get_context_start(self):
+        # Elements can remove trailing newlines and look at the resulting last line, but can't see or change anything before that
+        end = len(self.text)
+        while end and self.text[end - 1] == "\n":
+            end -= 1
+        return self.text.rfind("\n", 0, end) + 1
+
+    def check_budget(self):
+        maxOutput = self.budget.maxOutput
+        # text in open tables and dropdowns isn't in self.text until they end
+        if maxOutput is not None and len(self.text) + sum((p.textLength for p in self.currentSubParsers)) > maxOutput:
+            self.end_sub_parsers()
+            self.text = self.text[:maxOutput] + "\n... output truncated at " + format(maxOutput, ",") + " characters\n"
+            raise BudgetAbort()
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.end_sub_parsers()
+            self.text += "\n... conversion stopped after " + str(self.budget.timeLimit) + " seconds\n"
+            raise BudgetAbort()
+
+    def end_sub_parsers(self):
+        # write what open tables and dropdowns have so far, rather than losing it
+        while self.currentSubParsers:
+            self.end_sub_parser()
+
+    def truncate_text(self, content):
+        maxTextLength = self.budget.maxTextLength
+        if maxTextLength is not None and len(content) > maxTextLength and not self.inStyle:
+            return content[:maxTextLength] + " " + count_more(len(content) - maxTextLength, "characters")
+        return content
+
     def getElementProperties(self, attrs):
         cls = get_attr_value(attrs, "class")
         elementProperties = set(cls.split()) if cls else set()
@@ -112,21 +426,13 @@ class HtmlExtractParser(HTMLParser):
                 elementProperties.add(id)
         return elementProperties
 
-    def is_kendo_icon(self, prop):
-        return prop.startswith("k-i-") or prop.startswith("k-svg-i-") or prop.startswith("icon-")
-
-    def is_font_awesome_icon(self, prop):
-        return prop.startswith("fa-") and prop != "fa-icon" and not prop.startswith("fa-w-")
-
     def get_icon_properties(self, elementProperties):
-        iconProps = set()
-        for prop in elementProperties:
-            if prop in self.iconProperties or self.is_font_awesome_icon(prop) or self.is_kendo_icon(prop):
-                iconProps.add(prop)
-        return iconProps
+        is_icon_property = self.options.is_icon_property
+        return set((prop for prop in elementProperties if is_icon_property(prop)))
 
     def has_icon(self, elementProperties):
-        return len(self.get_icon_properties(elementProperties)) > 0
+        is_icon_property = self.options.is_icon_property
+        return any((is_icon_property(prop) for prop in elementProperties))
     
     def get_icon_name(self, elementProperties):
         is_icon = "icon" in elementProperties
@@ -142,6 +448,10 @@ class HtmlExtractParser(HTMLParser):
         else:
             return ""
 
+    def is_hidden(self, name, attrs, display, elementProperties):
+        # If Javascript is disabled then we won't be able to test noscript anyway...
+        return not self.propertiesToIgnore.isdisjoint(elementProperties) or self.is_invisible(attrs, display, elementProperties) or name == "noscript"
+
     def is_invisible(self, attrs, display, elementProperties):
         if self.show_invisible:
             return False
@@ -174,7 +484,7 @@ class HtmlExtractParser(HTMLParser):
                 info[key.strip()] = value.strip()
         return info
 
-    def get_display_style(self, attrs):
+    def get_display_style(self, attrs, name=None):
         test_display = get_attr_value(attrs, "data-test-explicit-display")
         if test_display:
             return test_display
@@ -190,12 +500,12 @@ class HtmlExtractParser(HTMLParser):
                 (style_info.get("left", "").startswith("-") or style_info.get("top", "").startswith("-")):
                 return "none"
 
+        if self.displayRules is not None:
+            display = self.displayRules.get_display(name, attrs)
+            if display and is_explicit_display(name, display):
+                return display
         return "unknown"
 
-    def is_navigation_tag(self, name):
-        return name in ("nav", "app-nav-menu")
-
-
     def enter_dialog(self, modal=True):
         self.reset_for_dialog()
         title = " Modal dialog " if modal else " Dialog "
@@ -210,29 +520,43 @@ class HtmlExtractParser(HTMLParser):
         self.ignoreRecursionLevel = 1
 
     def handle_starttag(self, rawname, attrs):
-        self.afterDataText = self.afterDataText.rstrip()
+        if self.budget is not None:
+            self.check_budget()
         name = rawname.lower()
+        if self.outOfScope:
+            # Only stylesheets and hidden ancestors matter outside the chosen element, see checkStyleForSliders
+            if self.ignoreUntilCloseTag:
+                if self.options.is_scope_element(attrs):
+                    raise ScopeAbort() # not shown, so nothing to write
+                if self.ignoreUntilCloseTag == name:
+                    self.ignoreRecursionLevel += 1
+                return
+            if not self.options.is_scope_element(attrs):
+                if name == "style":
+                    self.inStyle = True
+                elif name not in self.voidTags and self.is_hidden(name, attrs, self.get_display_style(attrs, name), self.getElementProperties(attrs)):
+                    self.ignore_until_tag(name)
+                return
+            self.outOfScope = False
+            self.inBody = True
+            self.scopeTag = name
+        self.afterDataText = self.afterDataText.rstrip()
         if name not in self.voidTags:
             self.level += 1
+            if name == self.scopeTag:
+                self.scopeDepth += 1
         elementProperties = self.getElementProperties(attrs)
-        display = self.get_display_style(attrs)
+        display = self.get_display_style(attrs, name)
+        handler = self.tagHandlers.get(name)
         if self.ignoreUntilCloseTag:
             if self.ignoreUntilCloseTag == name:
                 self.ignoreRecursionLevel += 1
-        elif not self.propertiesToIgnore.isdisjoint(elementProperties) or self.is_invisible(attrs, display, elementProperties) or name == "noscript": # If Javascript is disabled then we won't be able to test it anyway...
+        elif self.is_hidden(name, attrs, display, elementProperties):
             # if the name is a void tag like "input", close tag will never come. Ignore this but don't set anything else.
             if name not in self.voidTags:
                 self.ignore_until_tag(name)
-        elif name == "table":
-            if len(self.currentSubParsers) > 0:
-                self.currentSubParsers[-1].addText("\n")  
-            elif not self.text.endswith("\n"):
-                self.text += "\n"
-            self.currentSubParsers.append(TableParser())
-        elif name == "select":
-            if not self.text.endswith("\n"):
-                self.text += "\n"
-            self.currentSubParsers.append(SelectParser())
+        elif handler is not None and handler.opensSubParser:
+            handler.start(self, name, attrs, elementProperties)
         else:
             if elementProperties and (name == "i" or self.has_icon(elementProperties)):
                 self.afterDataText += self.get_icon_name(elementProperties)
@@ -246,85 +570,13 @@ class HtmlExtractParser(HTMLParser):
             elif display == "flex":
                 self.add_flex_tag(name)
 
-            if name == "button":
-                self.handle_data("Button '")
-            elif self.is_navigation_tag(name):
-                self.addText("\n(Navigation:\n")
-            elif name == "li":
-                text = ""
-                if self.liLevel > 0:
-                    if not self.text.endswith("\n"):
-                        text += "\n"
-                    text += "  " * self.liLevel
-                text += "- "
-                self.beforeDataText = text
-                self.liLevel += 1
-            elif name == "br":
-                self.addText("\n")
-            elif name == "p":
-                if not self.text.endswith("\n\n"):
-                    self.addText("\n\n")
-            elif name == "input":
-                input_type = get_attr_value(attrs, "type")
-                if input_type in [ "button", "submit" ]:
-                    value = get_attr_value(attrs, "value")
-                    data = "Button '" + value + "'"
-                    if input_type == "submit":
-                        data += " (submit)"
-                    self.handle_data(data)                        
-                elif input_type == "radio":
-                    self.handle_data("( ) ")
-                elif input_type == "checkbox":
-                    self.handle_data("[ ] ")
-                elif input_type != "hidden":
-                    text = "=== "
-                    placeholder = get_attr_value(attrs, "placeholder")
-                    if placeholder:
-                        text += "_" + placeholder + "_"
-                    text += " ==="
-                    if input_type in ("password", "datetime-local"):
-                        text += " (" + input_type + ")"
-                    self.handle_data(text)
-
-            elif name == "textarea":
-                self.addText("\n" + "=" * 10 + "\n")
-            elif name == "b":
-                self.addText("*")
-            elif name == "sup":
-                self.inSuperscript = True
-                self.addText("^")
+            if handler is not None and (handler.startInSubParser or not self.currentSubParsers):
+                handler.start(self, name, attrs, elementProperties)
             elif self.currentSubParsers:
                 self.currentSubParsers[-1].startElement(name, attrs, self.in_flex())
-            elif name == "body":
-                self.inBody = True
-            elif name == "script":
-                self.inScript = True
-            elif name == "hr":
-                if not self.text.endswith("\n"):
-                    self.text += "\n"
-                self.text += "_" * 100 + "\n"
-            elif name == "a":
-                self.linkStart = len(self.text)
-            elif name == "footer":
-                self.addText("\n")
-            elif name == "div":
-                if not self.in_flex() and not self.text.endswith("\n"):
-                    self.beforeDataText = "\n"
-                if self.has_modal_property(elementProperties):
-                    self.modalDivLevel = self.level
-                    self.enter_dialog(modal=True)
-            elif name == "style":
-                self.inStyle = True
-            elif name == "dialog":
-                if "open" in dict(attrs):
-                    modal = self.has_modal_property(elementProperties)
-                    self.enter_dialog(modal)
-                else:
-                    self.ignore_until_tag("dialog")
-            elif self.text.strip() and name in [ "h1", "h2", "h3", "h4" ]:
-                while not self.text.endswith("\n\n"):
-                    self.text += "\n"
-                    
+        if self.scopeTag == name and self.scopeDepth == 0: # void element chosen, already written
+            raise ScopeAbort()
+
     def add_flex_tag(self, flexTag):
         self.flexData[self.level] = flexTag, len(self.text), False
                     
@@ -334,15 +586,20 @@ class HtmlExtractParser(HTMLParser):
                     
     def reset_for_dialog(self):
         self.text = ""
+        self.lineState.invalidate()
         self.flexData.clear()
         self.beforeDataText = ""
         self.afterDataText = ""
+        self.earlierTextChanges += 1 # see is_self_contained
         
     def in_flex(self):
         if self.level - 1 not in self.flexData:
             return False
 
         _, flexStartPos, _ = self.flexData.get(self.level - 1)
+        if self.lineState.get_line_start(self.text) <= flexStartPos:
+            # no newlines at all since the flex element started
+            return True
         textSinceFlexStart = self.text[flexStartPos:]
         return "\n" not in textSinceFlexStart.strip()
     
@@ -354,6 +611,14 @@ class HtmlExtractParser(HTMLParser):
 
     def handle_endtag(self, rawname):
         name = rawname.lower()
+        if self.outOfScope:
+            if name == "style":
+                self.inStyle = False
+            elif self.ignoreUntilCloseTag == name:
+                self.ignoreRecursionLevel -= 1
+                if self.ignoreRecursionLevel == 0:
+                    self.ignoreUntilCloseTag = ""
+            return
         self.beforeDataText = ""
         self.handle_after_data_text()
         for flexDivLevel, (flexTag, _, hadDivs) in self.flexData.items():
@@ -367,72 +632,48 @@ class HtmlExtractParser(HTMLParser):
                 self.ignoreRecursionLevel -= 1
                 if self.ignoreRecursionLevel == 0:
                     self.ignoreUntilCloseTag = ""
-        elif name in [ "select", "table" ]:
-            parser = self.currentSubParsers.pop()
-            currText = parser.getText()
-            if self.currentSubParsers:
-                self.currentSubParsers[-1].addText(currText)
-            else:
-                self.text += currText
-                if not currText.endswith("\n"):
-                    self.text += "\n"
-        elif name == "button":
-            self.handle_data("'")
-        elif name == "sup":
-            self.inSuperscript = False
-        elif name == "b":
-            self.addText("*")
-        elif name == "li":
-            self.liLevel -= 1
-            if self.liLevel == 0 and not self.text.endswith("\n"):
-                self.text += "\n"
-        elif self.currentSubParsers and name != "img":
-            self.currentSubParsers[-1].endElement(name)
-        elif name == "p":
-            if not self.text.endswith("\n\n"):
-                self.addText("\n\n")
-        elif name == "div":
-            if self.level == self.modalDivLevel:
-                self.modalDivLevel = None
-                self.end_dialog()
-            if self.in_flex():
-                self.text = self.text.rstrip("\n")
-                self.set_flex_div_flag()
-            else:
-                if not self.text.endswith("\n"):
-                    self.addText("\n")
-        elif name == "dialog":
-            self.end_dialog()
-        elif self.is_navigation_tag(name):
-            self.addText(")")
-        elif name == "textarea":
-            self.addText("\n" + "=" * 10)
-        elif name == "script":
-            self.inScript = False
-        elif name == "style":
-            self.inStyle = False
-        elif name in [ "h1", "h2", "h3", "h4" ]:
-            self.text += getUnderline(self.text)
-        elif name == "a":
-            linkText = self.text[self.linkStart:].strip()
-            if "\n" in linkText:
-                # make sure multiline links hang together
-                self.text = self.text[:self.linkStart] + "\n"
-                lines = linkText.splitlines()
-                width = max((len(line) for line in lines))
-                for line in lines:
-                    self.text += line.ljust(width) + "->\n"
-            else:
-                self.text = self.text[:self.linkStart] + linkText + "->  "
-            self.linkStart = None
+        else:
+            handler = self.tagHandlers.get(name)
+            if handler is not None and (handler.endInSubParser or not self.currentSubParsers):
+                handler.end(self, name)
+            elif self.currentSubParsers and name != "img":
+                self.currentSubParsers[-1].endElement(name)
         self.level -= 1
+        if name == self.scopeTag:
+            self.scopeDepth -= 1
+            if self.scopeDepth == 0:
+                raise ScopeAbort()
+
+    def end_sub_parser(self):
+        parser = self.currentSubParsers.pop()
+        currText = parser.getText()
+        if self.currentSubParsers:
+            self.currentSubParsers[-1].addText(currText)
+        else:
+            self.text += currText
+            if not currText.endswith("\n"):
+                self.text += "\n"
+
+    def end_link(self):
+        if self.linkStart is None: # unbalanced link tags, the whole text is treated as a link
+            self.earlierTextChanges += 1
+        linkText = self.text[self.linkStart:].strip()
+        if "\n" in linkText:
+            # make sure multiline links hang together
+            self.text = self.text[:self.linkStart] + "\n"
+            lines = linkText.splitlines()
+            width = max((len(line) for line in lines))
+            for line in lines:
+                self.text += line.ljust(width) + "->\n"
+        else:
+            self.text = self.text[:self.linkStart] + linkText + "->  "
+        self.lineState.invalidate()
+        self.linkStart = None
 
     def fixWhitespace(self, line):
         if self.inSuperscript:
             return line.strip()
-        while "  " in line:
-            line = line.replace("  ", " ")
-        return line
+        return multiple_spaces.sub(" ", line)
 
     def handle_after_data_text(self):
         if self.afterDataText:
@@ -442,6 +683,11 @@ class HtmlExtractParser(HTMLParser):
             self.afterDataText = ""
 
     def handle_data(self, content):
+        if self.outOfScope and not self.inStyle:
+            return
+        if self.budget is not None:
+            self.check_budget()
+            content = self.truncate_text(content)
         if not self.ignoreUntilCloseTag:
             if content == '\xa0': # non-breaking space, remove block lines
                 self.addText(" ")
@@ -464,13 +710,15 @@ class HtmlExtractParser(HTMLParser):
 
     def addText(self, text):
         if self.inStyle:
+            if self.displayRules is not None:
+                self.displayRules.add_stylesheet(text)
             for dimension in [ "width", "height" ]:
                 self.checkStyleForSliders(text, dimension)
         elif self.currentSubParsers:
             self.currentSubParsers[-1].addText(text)
         elif self.inBody and not self.inScript:
             if not text.isspace() or shouldAddWhitespace(text, self.text):
-                adapted_text = adapt_spaces(text.strip(" "), self.text)
+                adapted_text = adapt_spaces(text.strip(" "), self.text, self.lineState)
                 self.text += adapted_text
             
     def checkStyleForSliders(self, text, dimension):
@@ -509,13 +757,78 @@ class HtmlExtractParser(HTMLParser):
         else:
             return set(text.lstrip(".").split(".")), None
                     
+class IncrementalParser(HtmlExtractParser):
+    """ For rendering a sequence of similar pages, e.g. those from capture_numbered. Reuses the text written for element subtrees
+    that were identical in the previous page, if the parser was in the same state when they started.
+    So the result is the same as rendering each page on its own """
+    def __init__(self, options=None):
+        HtmlExtractParser.__init__(self, options=options)
+        self.fragments = {}
+
+    def replay(self, document):
+        if self.options.collapse_repeats: # reused fragments would hide where repeats start and end
+            return HtmlExtractParser.replay(self, document)
+        if self.budget is not None and (self.budget.maxOutput is not None or self.budget.timeLimit is not None):
+            # budgets are checked as elements are written, which reused fragments aren't
+            return HtmlExtractParser.replay(self, document)
+        events = document.events
+        subtrees = document.find_subtrees()
+        fragments = {}
+        openSubtrees = []
+        ix = 0
+        try:
+            while ix < len(events):
+                subtree = subtrees.get(ix)
+                if subtree is not None and self.is_self_contained():
+                    endIx, subtreeHash = subtree
+                    contextStart = self.get_context_start()
+                    context = self.text[contextStart:]
+                    hasText = bool(context.strip() or self.text[:contextStart].strip())
+                    key = subtreeHash, context, hasText, self.get_state(), self.get_stylesheet_fingerprint()
+                    fragment = self.fragments.get(key)
+                    if fragment is not None:
+                        fragments[key] = fragment
+                        text, state = fragment
+                        self.text = self.text[:contextStart] + text
+                        self.lineState.invalidate()
+                        self.set_state(state)
+                        ix = endIx + 1
+                        continue
+                    openSubtrees.append((endIx, key, contextStart, self.earlierTextChanges, self.get_stylesheet_fingerprint()))
+
+                event = events[ix]
+                kind = event[0]
+                if kind == DATA:
+                    self.handle_data(event[1])
+                elif kind == START:
+                    self.handle_starttag(event[1], event[2])
+                else:
+                    self.handle_endtag(event[1])
+
+                if openSubtrees and openSubtrees[-1][0] == ix:
+                    _, key, contextStart, earlierTextChanges, fingerprint = openSubtrees.pop()
+                    # reusing a subtree with <style> elements inside would skip adding their rules
+                    if earlierTextChanges == self.earlierTextChanges and fingerprint == self.get_stylesheet_fingerprint() and self.is_self_contained():
+                        fragments[key] = self.text[contextStart:], self.get_state()
+                ix += 1
+        finally:
+            self.fragments = fragments
+
+
 class SelectParser:
-    def __init__(self):
+    def __init__(self, budget=None):
         self.options = []
         self.inOption = False
+        self.maxOptions = budget.maxOptions if budget is not None else None
+        self.elidedOptions = 0
+        self.textLength = 0
 
     def startElement(self, name, *args):
         if name == "option":
+            if self.maxOptions is not None and len(self.options) >= self.maxOptions:
+                self.elidedOptions += 1
+                self.inOption = False
+                return
             self.options.append("")
             self.inOption = True
 
@@ -526,18 +839,32 @@ class SelectParser:
     def addText(self, text):
         if self.inOption:
             self.options[-1] += text
+            self.textLength += len(text)
 
     def getText(self):
-        return "Dropdown (" + ", ".join(self.options) + ")"
+        options = self.options
+        if self.elidedOptions:
+            options = options + [ count_more(self.elidedOptions, "options") ]
+        return "Dropdown (" + ", ".join(options) + ")"
 
 
 class TableParser:
-    def __init__(self):
+    def __init__(self, budget=None):
         self.headerRows = []
         self.currentRow = None
         self.currentRowIsHeader = True
         self.grid = []
         self.activeElements = {}
+        self.cellState = LineState()
+        self.maxRows = budget.maxTableRows if budget is not None else None
+        self.elidedRows = 0
+        self.skippingRow = False
+        self.textLength = 0 # of the cells, for Budget.maxOutput
+
+    def addCell(self, text):
+        self.currentRow.append(text)
+        self.textLength += len(text)
+        self.cellState.invalidate()
 
     def isCell(self, name):
         return name in ["td", "th"]
@@ -546,15 +873,22 @@ class TableParser:
         return name in ["tr"]
 
     def startElement(self, name, attrs, flex):
+        if self.skippingRow:
+            return
         self.activeElements[name] = attrs
         if self.isRow(name):
+            if self.maxRows is not None and len(self.grid) + len(self.headerRows) >= self.maxRows:
+                self.elidedRows += 1
+                self.skippingRow = True
+                self.currentRow = None
+                return
             self.currentRow = []
         elif self.isCell(name):
             if self.currentRow is None:
                 sys.stderr.write("ERROR: Received '" + name + "' element in unexpected context (no table row). Attrs = " + repr(attrs) + "\n")
                 sys.stderr.write("Grid so far = " + repr(self.grid) + "\n")
             else:
-                self.currentRow.append("")
+                self.addCell("")
                 if name == "td" and "thead" not in self.activeElements:
                     self.currentRowIsHeader = False
         elif name == "div" and self.currentRow is not None and len(self.currentRow) and \
@@ -562,14 +896,20 @@ class TableParser:
             self.currentRow[-1] += "\n"
 
     def endElement(self, name):
+        if self.skippingRow:
+            if self.isRow(name):
+                self.skippingRow = False
+                del self.activeElements[name]
+            return
         if name in self.activeElements:  # Don't fail on duplicated end tags
             if self.currentRow is not None and self.isCell(name):
                 if self.currentRow[-1].endswith("\n"):
                     self.currentRow[-1] = self.currentRow[-1].rstrip()
+                    self.cellState.invalidate()
                 colspan = get_attr_value(self.activeElements[name], "colspan")
                 if colspan:
                     for _ in range(int(colspan) - 1):
-                        self.currentRow.append("")
+                        self.addCell("")
             del self.activeElements[name]
             if self.isRow(name) and self.currentRow is not None:
                 if len(self.currentRow):
@@ -583,7 +923,7 @@ class TableParser:
 
     def getText(self):
         if len(self.grid) == 0 and len(self.headerRows) == 0:
-            return ""
+            return count_more(self.elidedRows, "rows") + "\n" if self.elidedRows else ""
         
         if len(self.grid) > 0:
             columnCount = max((len(r) for r in self.grid))
@@ -596,7 +936,11 @@ class TableParser:
             formatter = GridFormatterWithHeader(self.headerRows, self.grid, columnCount, allowHeaderOverlap=True)
         else:
             formatter = GridFormatter(self.grid, columnCount)
-        return str(formatter)
+        text = str(formatter)
+        if self.elidedRows:
+            # GridFormatter doesn't end with a newline, GridFormatterWithHeader does
+            return text + ("" if text.endswith("\n") else "\n") + count_more(self.elidedRows, "rows") + "\n"
+        return text
 
     def isSpaces(self, text):
         return len(text) and all((c == " " for c in text))
@@ -605,40 +949,366 @@ class TableParser:
         if self.currentRow is not None:
             if len(self.currentRow):
                 if text.strip() or shouldAddWhitespace(text, self.currentRow[-1]):
-                    adapted_text = adapt_spaces(text, self.currentRow[-1])
+                    adapted_text = adapt_spaces(text, self.currentRow[-1], self.cellState)
                     self.currentRow[-1] += adapted_text
+                    self.textLength += len(adapted_text)
             elif text.strip():
                 self.currentRowIsHeader = False
-                self.currentRow.append(text)
+                self.addCell(text)
+
+class TagHandler:
+    """ Describes how HtmlExtractParser writes a particular element. Register instances with register_tag_handler.
+    Inside tables and dropdowns, elements are passed on to the sub-parser unless the handler says otherwise """
+    startInSubParser = False
+    endInSubParser = False
+    # Handlers that open a sub-parser bypass the generic icon and display handling
+    opensSubParser = False
+
+    def start(self, parser, name, attrs, elementProperties):
+        pass
+
+    def end(self, parser, name):
+        pass
+
+
+class TableHandler(TagHandler):
+    opensSubParser = True
+    endInSubParser = True
+    def start(self, parser, name, attrs, elementProperties):
+        if len(parser.currentSubParsers) > 0:
+            parser.currentSubParsers[-1].addText("\n")
+        elif not parser.text.endswith("\n"):
+            parser.text += "\n"
+        parser.currentSubParsers.append(TableParser(parser.budget))
+
+    def end(self, parser, name):
+        parser.end_sub_parser()
+
+
+class SelectHandler(TagHandler):
+    opensSubParser = True
+    endInSubParser = True
+    def start(self, parser, name, attrs, elementProperties):
+        if not parser.text.endswith("\n"):
+            parser.text += "\n"
+        parser.currentSubParsers.append(SelectParser(parser.budget))
+
+    def end(self, parser, name):
+        parser.end_sub_parser()
+
+
+class ButtonHandler(TagHandler):
+    startInSubParser = True
+    endInSubParser = True
+    def start(self, parser, name, attrs, elementProperties):
+        parser.handle_data("Button '")
+
+    def end(self, parser, name):
+        parser.handle_data("'")
+
+
+class NavigationHandler(TagHandler):
+    startInSubParser = True
+    def start(self, parser, name, attrs, elementProperties):
+        parser.addText("\n(Navigation:\n")
+
+    def end(self, parser, name):
+        parser.addText(")")
+
+
+class ListItemHandler(TagHandler):
+    startInSubParser = True
+    endInSubParser = True
+    def start(self, parser, name, attrs, elementProperties):
+        text = ""
+        if parser.liLevel > 0:
+            if not parser.text.endswith("\n"):
+                text += "\n"
+            text += "  " * parser.liLevel
+        text += "- "
+        parser.beforeDataText = text
+        parser.liLevel += 1
+
+    def end(self, parser, name):
+        parser.liLevel -= 1
+        if parser.liLevel == 0 and not parser.text.endswith("\n"):
+            parser.text += "\n"
+
+
+class LineBreakHandler(TagHandler):
+    startInSubParser = True
+    def start(self, parser, name, attrs, elementProperties):
+        parser.addText("\n")
+
+
+class ParagraphHandler(TagHandler):
+    startInSubParser = True
+    def start(self, parser, name, attrs, elementProperties):
+        self.end(parser, name)
+
+    def end(self, parser, name):
+        if not parser.text.endswith("\n\n"):
+            parser.addText("\n\n")
+
+
+class InputHandler(TagHandler):
+    startInSubParser = True
+    def start(self, parser, name, attrs, elementProperties):
+        input_type = get_attr_value(attrs, "type")
+        if input_type in [ "button", "submit" ]:
+            value = get_attr_value(attrs, "value")
+            data = "Button '" + value + "'"
+            if input_type == "submit":
+                data += " (submit)"
+            parser.handle_data(data)
+        elif input_type == "radio":
+            parser.handle_data("( ) ")
+        elif input_type == "checkbox":
+            parser.handle_data("[ ] ")
+        elif input_type != "hidden":
+            text = "=== "
+            placeholder = get_attr_value(attrs, "placeholder")
+            if placeholder:
+                text += "_" + placeholder + "_"
+            text += " ==="
+            if input_type in ("password", "datetime-local"):
+                text += " (" + input_type + ")"
+            parser.handle_data(text)
+
+
+class TextAreaHandler(TagHandler):
+    startInSubParser = True
+    def start(self, parser, name, attrs, elementProperties):
+        parser.addText("\n" + "=" * 10 + "\n")
+
+    def end(self, parser, name):
+        parser.addText("\n" + "=" * 10)
+
+
+class BoldHandler(TagHandler):
+    startInSubParser = True
+    endInSubParser = True
+    def start(self, parser, name, attrs, elementProperties):
+        parser.addText("*")
+
+    def end(self, parser, name):
+        parser.addText("*")
+
+
+class SuperscriptHandler(TagHandler):
+    startInSubParser = True
+    endInSubParser = True
+    def start(self, parser, name, attrs, elementProperties):
+        parser.inSuperscript = True
+        parser.addText("^")
+
+    def end(self, parser, name):
+        parser.inSuperscript = False
+
+
+class BodyHandler(TagHandler):
+    def start(self, parser, name, attrs, elementProperties):
+        parser.inBody = True
+
+
+class FlagHandler(TagHandler):
+    """ Sets a flag on the parser for as long as the element is open """
+    def __init__(self, flagName):
+        self.flagName = flagName
+
+    def start(self, parser, name, attrs, elementProperties):
+        setattr(parser, self.flagName, True)
+
+    def end(self, parser, name):
+        setattr(parser, self.flagName, False)
+
+
+class HorizontalRuleHandler(TagHandler):
+    def start(self, parser, name, attrs, elementProperties):
+        if not parser.text.endswith("\n"):
+            parser.text += "\n"
+        parser.text += "_" * 100 + "\n"
+
+
+class LinkHandler(TagHandler):
+    def start(self, parser, name, attrs, elementProperties):
+        parser.linkStart = len(parser.text)
+
+    def end(self, parser, name):
+        parser.end_link()
+
+
+class FooterHandler(TagHandler):
+    def start(self, parser, name, attrs, elementProperties):
+        parser.addText("\n")
+
+
+class DivHandler(TagHandler):
+    def start(self, parser, name, attrs, elementProperties):
+        if not parser.in_flex() and not parser.text.endswith("\n"):
+            parser.beforeDataText = "\n"
+        if parser.has_modal_property(elementProperties):
+            parser.modalDivLevel = parser.level
+            parser.enter_dialog(modal=True)
+
+    def end(self, parser, name):
+        if parser.level == parser.modalDivLevel:
+            parser.modalDivLevel = None
+            parser.end_dialog()
+        if parser.in_flex():
+            parser.text = parser.text.rstrip("\n")
+            parser.lineState.invalidate()
+            parser.set_flex_div_flag()
+        else:
+            if not parser.text.endswith("\n"):
+                parser.addText("\n")
+
+
+class DialogHandler(TagHandler):
+    def start(self, parser, name, attrs, elementProperties):
+        if "open" in dict(attrs):
+            modal = parser.has_modal_property(elementProperties)
+            parser.enter_dialog(modal)
+        else:
+            parser.ignore_until_tag(name)
+
+    def end(self, parser, name):
+        parser.end_dialog()
+
+
+class HeadingHandler(TagHandler):
+    def start(self, parser, name, attrs, elementProperties):
+        if parser.text.strip():
+            while not parser.text.endswith("\n\n"):
+                parser.text += "\n"
+
+    def end(self, parser, name):
+        parser.text += getUnderline(parser.text)
+
+
+tag_handlers = {}
+
+def register_tag_handler(handler, *names):
+    """ Use the given TagHandler for elements with any of the given names, e.g. custom elements in a particular application """
+    for name in names:
+        tag_handlers[name.lower()] = handler
+
+register_tag_handler(TableHandler(), "table")
+register_tag_handler(SelectHandler(), "select")
+register_tag_handler(ButtonHandler(), "button")
+register_tag_handler(NavigationHandler(), "nav", "app-nav-menu")
+register_tag_handler(ListItemHandler(), "li")
+register_tag_handler(LineBreakHandler(), "br")
+register_tag_handler(ParagraphHandler(), "p")
+register_tag_handler(InputHandler(), "input")
+register_tag_handler(TextAreaHandler(), "textarea")
+register_tag_handler(BoldHandler(), "b")
+register_tag_handler(SuperscriptHandler(), "sup")
+register_tag_handler(BodyHandler(), "body")
+register_tag_handler(FlagHandler("inScript"), "script")
+register_tag_handler(FlagHandler("inStyle"), "style")
+register_tag_handler(HorizontalRuleHandler(), "hr")
+register_tag_handler(LinkHandler(), "a")
+register_tag_handler(FooterHandler(), "footer")
+register_tag_handler(DivHandler(), "div")
+register_tag_handler(DialogHandler(), "dialog")
+register_tag_handler(HeadingHandler(), "h1", "h2", "h3", "h4")
 
 def parseList(text):
     return set(text.split(",")) if text else set()
 
-def main_cli():
-    parser = argparse.ArgumentParser(description='Program to write HTML as ASCII art, suitable for e.g. TextTest testing')
+def create_arg_parser(prog=None):
+    import argparse # not needed when used as a library
+    parser = argparse.ArgumentParser(prog=prog, description='Program to write HTML as ASCII art, suitable for e.g. TextTest testing')
     parser.add_argument('--ignore', default="", help='Comma-separated list of CSS classes to ignore')
     parser.add_argument('--icons', default="", help='Comma-separated list of CSS classes to treat as icons')
     parser.add_argument('--modals', default="", help='Comma-separated list of CSS classes to treat as modal dialogs')
     parser.add_argument('--show-invisible', action='store_true', help='Show all elements, even if invisible. Mainly useful for simplifying tests by avoiding extra clicks')
+    parser.add_argument('--use-stylesheets', action='store_true', help="Work out which elements are hidden or blocks from the page's own <style> elements. For pages captured without explicit display tags")
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument('--only-test-id', help='Only write the element with this data-test-id, and stop once it has been written')
+    scope.add_argument('--only-id', help='Only write the element with this id, and stop once it has been written')
+    scope.add_argument('--only-class', help='Only write the first element with this CSS class, and stop once it has been written')
+    parser.add_argument('--collapse-repeats', action='store_true', help='Write sibling elements that look exactly the same, like the items of long lists, once with a repeat count')
+    parser.add_argument('--max-output', type=int, help='Stop writing a page after this many characters')
+    parser.add_argument('--max-table-rows', type=int, help='Only write this many rows of each table')
+    parser.add_argument('--max-options', type=int, help='Only write this many options of each dropdown')
+    parser.add_argument('--max-text-length', type=int, help='Only write this many characters of each piece of text')
+    parser.add_argument('--time-limit', type=float, help='Stop writing a page after this many seconds')
+    parser.add_argument('--incremental', action='store_true', help='When writing several files, reuse the text from the previous file for parts of the page that are unchanged. Does not affect the output')
+    parser.add_argument('--watch', metavar='DIR', help='Keep converting each HTML file written to this directory, to a .txt file next to it, until interrupted')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1), help='Number of processes converting files for --watch')
     parser.add_argument('filenames', nargs=argparse.REMAINDER)
-    args = parser.parse_args()
-    toIgnore = parseList(args.ignore)
-    iconProperties = parseList(args.icons)
-    modalProperties = parseList(args.modals)
-    multiple = len(args.filenames) > 1
-    sys.stdout.reconfigure(encoding='utf-8')
-    for i, filename in enumerate(args.filenames):
+    return parser
+
+def get_scope(args):
+    if args.only_test_id:
+        return "data-test-id", args.only_test_id
+    elif args.only_id:
+        return "id", args.only_id
+    elif args.only_class:
+        return "class", args.only_class
+
+def get_budget(args):
+    limits = args.max_output, args.max_table_rows, args.max_options, args.max_text_length, args.time_limit
+    if any((limit is not None for limit in limits)):
+        return Budget(*limits)
+
+def get_options(args):
+    return Options(parseList(args.ignore), parseList(args.icons), parseList(args.modals), args.show_invisible, scope=get_scope(args),
+                   use_stylesheets=args.use_stylesheets, budget=get_budget(args), collapse_repeats=args.collapse_repeats)
+
+default_options = Options()
+
+def run_parser(options, run):
+    # Parsers are kept and reused for later conversions with the same options.
+    # Threads may share the options, and list.pop is atomic where checking first isn't
+    parsers = options._parsers
+    try:
+        parser = parsers.pop()
+    except IndexError:
+        parser = HtmlExtractParser(options=options)
+    try:
+        return run(parser)
+    finally:
+        parser.reset()
+        parsers.append(parser)
+
+def convert(html, options=default_options):
+    """ Convert the given HTML text to ASCII art """
+    return run_parser(options, lambda parser: parser.parse(html))
+
+def render(document, options=default_options):
+    """ Convert a Document, as returned by parse_document, to ASCII art.
+    Cheaper than convert when writing the same page with several different options """
+    return run_parser(options, lambda parser: parser.render(document))
+
+def write_files(filenames, options, out, incremental=False):
+    multiple = len(filenames) > 1
+    incrementalParser = IncrementalParser(options) if incremental else None
+    for i, filename in enumerate(filenames):
         if multiple and i > 0:
-            print()
+            print(file=out)
         if multiple:
             stage = os.path.basename(filename).split(".", 1)[0]
             if len(stage) > 3 and stage[3] == "_" and stage[:3].isdigit():
                 stage = stage[4:]
             stage = " " + stage + " "
-            print(stage.center(30, "-"))
+            print(stage.center(30, "-"), file=out)
         text = open(filename, encoding="utf-8").read()
-        parser = HtmlExtractParser(toIgnore, iconProperties, modalProperties, args.show_invisible)
-        print(parser.parse(text))
+        if incrementalParser:
+            incrementalParser.reset()
+            print(incrementalParser.render(parse_document(text)), file=out)
+        else:
+            print(convert(text, options), file=out)
+
+def main_cli(argv=None):
+    args = create_arg_parser().parse_args(argv)
+    if args.watch:
+        from .html2ascii_watch import watch # imports this module, and rarely needed
+        return watch(args.watch, args, args.workers)
+    sys.stdout.reconfigure(encoding='utf-8')
+    write_files(args.filenames, get_options(args), sys.stdout, args.incremental)
 
 if __name__ == '__main__':
     main_cli()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+""" Thin drop-in replacement for html2ascii, which forwards its arguments to a running html2ascii-server
+    and so avoids paying for start-up and imports on every conversion.
+    If no server is running, it converts in-process instead. Deliberately imports as little as possible. """
+
+import sys, os, json, socket
+from ..privatedir import get_private_dir
+
+def get_socket_path():
+    return os.getenv("HTML2ASCII_SOCKET") or os.path.join(get_private_dir(), "html2ascii.sock")
+
+def request_conversion(argv, socketPath=None, connectTimeout=5):
+    # Returns None if there is no server to talk to, or it goes away without answering.
+    # Once connected there is no timeout: the server is converting, and converting again here would only add to the load
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    request = { "argv": argv, "cwd": os.getcwd() }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(connectTimeout)
+            sock.connect(socketPath or get_socket_path())
+            sock.settimeout(None)
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                return json.loads(f.readline())
+    except (OSError, ValueError): # includes the server closing the connection without answering
+        return None
+
+def is_watch_option(arg):
+    # argparse also accepts unambiguous abbreviations, and --wa is enough to tell it from --workers
+    option = arg.split("=", 1)[0]
+    return len(option) >= 4 and "--watch".startswith(option)
+
+def main_cli():
+    argv = sys.argv[1:]
+    if any((is_watch_option(arg) for arg in argv)):
+        sys.stderr.write("html2ascii-client: --watch is not supported, run html2ascii instead\n")
+        sys.exit(2)
+    response = request_conversion(argv)
+    if response is None:
+        from . import html2ascii
+        return html2ascii.main_cli(argv)
+
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    sys.exit(response["status"])
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+""" Long-running html2ascii process, listening on a Unix socket for requests from html2ascii-client.
+    Each request is a line of JSON with the html2ascii command line and working directory, each response
+    a line of JSON with the output, errors and exit status. """
+
+import sys, os, io, json, socket, argparse, socketserver, threading
+from contextlib import contextmanager
+from . import html2ascii
+from .html2ascii_client import get_socket_path
+
+
+class ConversionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line: # just checking whether we're running
+            return
+        request = json.loads(line)
+        response = self.server.convert(request["argv"], request["cwd"])
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class ThreadRedirectedStream:
+    """ Writes to the stream chosen by the current thread, so requests handled at the same time keep their output apart """
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    @contextmanager
+    def redirect(self, stream):
+        self.local.stream = stream
+        try:
+            yield
+        finally:
+            self.local.stream = self.default
+
+    def __getattr__(self, name):
+        return getattr(getattr(self.local, "stream", self.default), name)
+
+
+class ConversionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Handles each request in its own thread, so a slow conversion doesn't hold up the others.
+    Closing waits for the requests being handled """
+    def __init__(self, socketPath, idleTimeout=None):
+        socketserver.UnixStreamServer.__init__(self, socketPath, ConversionHandler)
+        self.argParser = html2ascii.create_arg_parser(prog="html2ascii")
+        self.optionCache = {}
+        self.optionLock = threading.Lock()
+        self.timeout = idleTimeout
+        self.timedOut = False
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = ThreadRedirectedStream(sys.stdout), ThreadRedirectedStream(sys.stderr)
+
+    def server_close(self):
+        socketserver.ThreadingMixIn.server_close(self)
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+
+    def get_options(self, args):
+        # Keeping the same Options object also means reusing its parsers
+        key = tuple(((arg, value) for arg, value in sorted(vars(args).items()) if arg not in ("filenames", "incremental")))
+        with self.optionLock:
+            options = self.optionCache.get(key)
+            if options is None:
+                options = html2ascii.get_options(args)
+                self.optionCache[key] = options
+            return options
+
+    def convert(self, argv, cwd):
+        out, err = io.StringIO(), io.StringIO()
+        status = 0
+        with sys.stdout.redirect(out), sys.stderr.redirect(err):
+            try:
+                args = self.argParser.parse_args(argv)
+                if args.watch:
+                    self.argParser.error("--watch is not supported via html2ascii-server, run html2ascii instead")
+                filenames = [ os.path.join(cwd, fn) for fn in args.filenames ]
+                html2ascii.write_files(filenames, self.get_options(args), out, args.incremental)
+            except SystemExit as e:
+                status = e.code or 0
+            except Exception:
+                err.write(html2ascii.getExceptionString())
+                status = 1
+        return { "stdout": out.getvalue(), "stderr": err.getvalue(), "status": status }
+
+    def handle_timeout(self):
+        self.timedOut = True
+
+
+def server_is_running(socketPath):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socketPath)
+            return True
+        except OSError:
+            return False
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Keep a warm html2ascii process running, for use via html2ascii-client')
+    parser.add_argument('--socket', help='Unix socket to listen on. Default taken from HTML2ASCII_SOCKET, or a file in a per-user directory in the temporary directory')
+    parser.add_argument('--idle-timeout', type=float, help='Exit after this many seconds without any requests')
+    args = parser.parse_args()
+    if args.socket is None:
+        try:
+            args.socket = get_socket_path()
+        except OSError as e:
+            sys.stderr.write(str(e) + "\n")
+            sys.exit(1)
+    if server_is_running(args.socket):
+        sys.stderr.write("html2ascii server already running at " + args.socket + "\n")
+        sys.exit(1)
+    if os.path.exists(args.socket):
+        os.remove(args.socket) # left behind by a server that didn't exit cleanly
+
+    server = ConversionServer(args.socket, args.idle_timeout)
+    try:
+        while not server.timedOut:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+
+if __name__ == '__main__':
+    main_cli()
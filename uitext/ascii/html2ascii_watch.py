@@ -0,0 +1,178 @@
+""" Watches a directory for HTML pages as selenium_utils.capture_all_text writes them, and converts each one
+    to a .txt file next to it while the test is still running. Used via html2ascii --watch.
+    Uses inotify on Linux, and otherwise polls the directory. Stops on Ctrl-C or SIGTERM, once pages already found are converted. """
+
+import os, sys, time, signal, struct, tempfile, threading, ctypes, ctypes.util
+from concurrent.futures import ProcessPoolExecutor
+from . import html2ascii
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+inotify_event = struct.Struct("iIII") # wd, mask, cookie, len, followed by the name
+
+def get_text_fn(fn):
+    return fn[:-len(".html")] + ".txt"
+
+def is_html_file(fn):
+    return fn.endswith(".html") and not os.path.basename(fn).startswith(".")
+
+
+class InotifyWatcher:
+    def __init__(self, dirName):
+        self.dirName = dirName
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Could not start inotify")
+        # Pages are complete once the file is closed, or moved in if written elsewhere first
+        if libc.inotify_add_watch(self.fd, os.fsencode(dirName), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "Could not watch " + dirName)
+
+    def wait_for_files(self):
+        data = os.read(self.fd, 65536)
+        fns = []
+        pos = 0
+        while pos < len(data):
+            _, _, _, nameLength = inotify_event.unpack_from(data, pos)
+            pos += inotify_event.size
+            name = os.fsdecode(data[pos:pos + nameLength].rstrip(b"\0"))
+            pos += nameLength
+            fns.append(os.path.join(self.dirName, name))
+        return fns
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    def __init__(self, dirName, interval=0.2):
+        self.dirName = dirName
+        self.interval = interval
+        # Files count as complete when they haven't changed since the previous look
+        self.lastSeen = self.find_files()
+        self.reported = dict(self.lastSeen)
+
+    def find_files(self):
+        files = {}
+        with os.scandir(self.dirName) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = stat.st_mtime_ns, stat.st_size
+        return files
+
+    def wait_for_files(self):
+        while True:
+            time.sleep(self.interval)
+            current = self.find_files()
+            fns = [ fn for fn, info in current.items() if self.lastSeen.get(fn) == info and self.reported.get(fn) != info ]
+            self.lastSeen = current
+            if fns:
+                self.reported.update(((fn, current[fn]) for fn in fns))
+                return fns
+
+    def close(self):
+        pass
+
+
+def create_watcher(dirName):
+    try:
+        return InotifyWatcher(dirName)
+    except (OSError, AttributeError, TypeError): # not Linux, or no libc to be found
+        return PollingWatcher(dirName)
+
+
+worker_options = None
+def init_worker(args):
+    global worker_options
+    worker_options = html2ascii.get_options(args)
+    # Ctrl-C reaches the workers too, but the watching process decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+def convert_file(fn):
+    with open(fn, encoding="utf-8") as f:
+        text = html2ascii.convert(f.read(), worker_options)
+    textFn = get_text_fn(fn)
+    # written under another name first, so nobody sees half a file
+    fd, tmpFn = tempfile.mkstemp(suffix=".tmp", prefix="." + os.path.basename(textFn) + ".", dir=os.path.dirname(textFn))
+    try:
+        with open(fd, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        os.replace(tmpFn, textFn)
+    except BaseException:
+        os.remove(tmpFn)
+        raise
+
+def needs_converting(fn):
+    textFn = get_text_fn(fn)
+    return not os.path.isfile(textFn) or os.path.getmtime(textFn) < os.path.getmtime(fn)
+
+
+class ConversionQueue:
+    """ Converts each page at most once at a time. A page written again while it is being converted is converted
+    again afterwards, so the last result written is always from the latest version """
+    def __init__(self, executor):
+        self.executor = executor
+        self.running = set()
+        self.rerun = set()
+        self.lock = threading.Lock()
+
+    def submit(self, fn):
+        with self.lock:
+            if fn in self.running:
+                self.rerun.add(fn)
+                return
+            self.running.add(fn)
+        self.start(fn)
+
+    def start(self, fn):
+        try:
+            future = self.executor.submit(convert_file, fn)
+        except RuntimeError: # shutting down
+            with self.lock:
+                self.running.discard(fn)
+            return
+        future.add_done_callback(lambda future: self.finished(fn, future))
+
+    def finished(self, fn, future):
+        exc = future.exception()
+        if exc is not None:
+            sys.stderr.write("Failed to convert page: " + str(exc) + "\n")
+        with self.lock:
+            again = fn in self.rerun
+            self.rerun.discard(fn)
+            if not again:
+                self.running.discard(fn)
+        if again:
+            self.start(fn)
+
+
+class StopWatching(Exception):
+    pass
+
+def stop_watching(signum, frame):
+    raise StopWatching()
+
+def watch(dirName, args, workers):
+    """ Convert pages in dirName as they appear, until interrupted. Pages already there are converted first if they need it """
+    previousHandler = signal.signal(signal.SIGTERM, stop_watching)
+    try:
+        # leaving the with statement waits for conversions already started
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(args,)) as executor:
+            conversions = ConversionQueue(executor)
+            watcher = create_watcher(dirName)
+            try:
+                fns = [ os.path.join(dirName, fn) for fn in sorted(os.listdir(dirName)) ]
+                while True:
+                    for fn in fns:
+                        if is_html_file(fn) and needs_converting(fn):
+                            conversions.submit(fn)
+                    fns = watcher.wait_for_files()
+            except (KeyboardInterrupt, StopWatching):
+                pass
+            finally:
+                watcher.close()
+    finally:
+        signal.signal(signal.SIGTERM, previousHandler)
@@ -0,0 +1,198 @@
+""" Module for storing the parsed form of an HTML page, so it can be written several times without parsing it again.
+Should not depend on how the page is written: see HtmlExtractParser.render for that """
+
+from html.parser import HTMLParser
+
+START, END, DATA = 0, 1, 2
+# elements likely to contain largely independent parts of a page
+subtree_tags = frozenset([ "div", "table", "dialog", "section", "main", "article", "aside", "form", "ul", "ol", "nav", "header", "footer" ])
+void_tags = frozenset([ 'area', 'base', 'br', 'col', 'command', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'meta', 'param', 'source', 'track', 'wbr' ])
+
+def hash_event(event):
+    if event[0] == START:
+        return hash((START, event[1], tuple(event[2])))
+    else:
+        return hash((event[0], event[1]))
+
+class Document:
+    """ The tags and text of an HTML page, in the order HTMLParser found them.
+    Which elements are shown and how depends on the options used when rendering, so nothing is decided here """
+    def __init__(self, events=None):
+        self.events = events if events is not None else []
+
+    def replay(self, handler):
+        handle_starttag, handle_endtag, handle_data = handler.handle_starttag, handler.handle_endtag, handler.handle_data
+        for event in self.events:
+            kind = event[0]
+            if kind == DATA:
+                handle_data(event[1])
+            elif kind == START:
+                handle_starttag(event[1], event[2])
+            else:
+                handle_endtag(event[1])
+
+    def find_subtrees(self, tagNames=subtree_tags):
+        """ Find all properly nested elements with the given names. Returns a dict of start event index to
+        the index of their end event and a hash of all events in between """
+        subtrees = {}
+        stack = []
+        openCounts = dict.fromkeys(tagNames, 0)
+        for ix, event in enumerate(self.events):
+            kind, name = event[0], event[1]
+            if kind == START and name in openCounts:
+                stack.append((name, ix, [ hash_event(event) ]))
+                openCounts[name] += 1
+            elif kind == END and openCounts.get(name):
+                while True:
+                    openName, startIx, parts = stack.pop()
+                    openCounts[openName] -= 1
+                    if openName == name:
+                        parts.append(hash_event(event))
+                        subtrees[startIx] = ix, hash((ix - startIx, tuple(parts)))
+                    # if not closed properly it can't be used alone, but it's still part of its parent
+                    if stack:
+                        stack[-1][2].append(hash(tuple(parts)))
+                    if openName == name:
+                        break
+            elif stack:
+                stack[-1][2].append(hash_event(event))
+        return subtrees
+
+    def dumps(self):
+        import json # only needed for saved documents, so not worth importing for every conversion
+        return json.dumps(self.events, separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, text):
+        import json
+        events = json.loads(text)
+        sharedEvents = {} # see DocumentRecorder
+        for ix, event in enumerate(events):
+            if event[0] == START: # JSON has no tuples, but parsers expect attributes as HTMLParser gives them
+                attrs = [ (attr, value) for attr, value in event[2] ]
+                key = START, event[1], tuple(attrs)
+                events[ix] = sharedEvents.setdefault(key, (START, event[1], attrs))
+            else:
+                event = event[0], event[1]
+                events[ix] = sharedEvents.setdefault(event, event)
+        return cls(events)
+
+    def save(self, fn):
+        with open(fn, "w", encoding="utf-8") as f:
+            f.write(self.dumps())
+
+    @classmethod
+    def load(cls, fn):
+        with open(fn, encoding="utf-8") as f:
+            return cls.loads(f.read())
+
+
+class DocumentRecorder(HTMLParser):
+    def reset(self):
+        HTMLParser.reset(self)
+        self.events = []
+        # Pages repeat the same elements and whitespace many times, so identical events are stored once.
+        # Nothing changes events or their attributes once recorded
+        self.sharedEvents = {}
+
+    def add_event(self, key, event):
+        self.events.append(self.sharedEvents.setdefault(key, event))
+
+    def handle_starttag(self, name, attrs):
+        self.add_event((START, name, tuple(attrs)), (START, name, attrs))
+
+    def handle_endtag(self, name):
+        event = END, name
+        self.add_event(event, event)
+
+    def handle_data(self, content):
+        event = DATA, content
+        self.add_event(event, event)
+
+
+def is_shadow_root(event):
+    return event[0] == START and event[1] == "template" and any((attr == "shadowrootmode" for attr, _ in event[2]))
+
+def find_end(events, ix, name):
+    # index of the end event closing an element with the given name that is open before ix
+    depth = 1
+    for endIx in range(ix, len(events)):
+        kind, eventName = events[endIx][0], events[endIx][1]
+        if eventName == name:
+            if kind == START:
+                depth += 1
+            elif kind == END:
+                depth -= 1
+                if depth == 0:
+                    return endIx
+    return len(events)
+
+def split_nodes(events):
+    nodes = []
+    depth = 0
+    for event in events:
+        kind = event[0]
+        if depth == 0 and not (kind == END and nodes):
+            nodes.append([])
+        nodes[-1].append(event)
+        if kind == START and event[1] not in void_tags:
+            depth += 1
+        elif kind == END and depth:
+            depth -= 1
+    return nodes
+
+def compose_shadow_root(shadowEvents, lightEvents):
+    slotted = {}
+    for node in split_nodes(lightEvents):
+        slot = dict(node[0][2]).get("slot") if node[0][0] == START else None
+        slotted.setdefault(slot or "", []).extend(node)
+    composed = []
+    ix = 0
+    while ix < len(shadowEvents):
+        event = shadowEvents[ix]
+        kind, name = event[0], event[1]
+        if kind == START and name in ("slot", "style"):
+            endIx = find_end(shadowEvents, ix + 1, name)
+            if name == "slot": # the content is only shown if nothing is put in the slot
+                composed += slotted.get(dict(event[2]).get("name") or "") or shadowEvents[ix + 1:endIx]
+            ix = endIx + 1
+        else:
+            if kind != END or name != "slot":
+                composed.append(event)
+            ix += 1
+    return composed
+
+def flatten_shadow_roots(events):
+    """ Replace the children of each shadow host written as a declarative shadow root (<template shadowrootmode=...>)
+    by the content of its shadow root, with the host's own children moved into its slots, as a browser shows them.
+    Styles inside shadow roots only apply there, so they are dropped """
+    flattened = []
+    openNames = []
+    ix = 0
+    while ix < len(events):
+        event = events[ix]
+        kind, name = event[0], event[1]
+        if openNames and is_shadow_root(event):
+            templateEndIx = find_end(events, ix + 1, "template")
+            hostEndIx = find_end(events, templateEndIx + 1, openNames[-1])
+            shadowEvents = flatten_shadow_roots(events[ix + 1:templateEndIx])
+            lightEvents = flatten_shadow_roots(events[templateEndIx + 1:hostEndIx])
+            flattened += compose_shadow_root(shadowEvents, lightEvents)
+            ix = hostEndIx
+            continue
+        if kind == START and name not in void_tags:
+            openNames.append(name)
+        elif kind == END and name in openNames:
+            while openNames.pop() != name:
+                pass
+        flattened.append(event)
+        ix += 1
+    return flattened
+
+def parse_document(text):
+    recorder = DocumentRecorder()
+    # No close(), to see exactly what HtmlExtractParser.parse would
+    recorder.feed(text)
+    if "shadowrootmode" in text:
+        return Document(flatten_shadow_roots(recorder.events))
+    return Document(recorder.events)
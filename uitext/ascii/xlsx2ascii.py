@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
 import sys, warnings
-import openpyxl
+from collections import deque
+from itertools import zip_longest
 from .gridformatter import GridFormatter, GridFormatterWithHeader
 
 def print_data(obj):
@@ -16,14 +17,19 @@ def print_data(obj):
 
 class WorkbookWriter:
     def __init__(self, fn):
+        import openpyxl # slow to import, so not needed for --help or bad arguments
         with open(fn, "rb") as f:
             with warnings.catch_warnings():
                 warnings.simplefilter("ignore")
                 self.workbook = openpyxl.load_workbook(f)
         self.style_cells = {}
+        self.style_descriptions = {}
+
+    def get_value_text(self, cell):
+        return str(cell.value) if cell.value is not None else ""
 
     def get_cell_text(self, cell):
-        text = str(cell.value) if cell.value is not None else ""
+        text = self.get_value_text(cell)
         if cell.has_style:
             text += "*" * cell.style_id
             if cell.style_id not in self.style_cells:
@@ -81,6 +87,15 @@ class WorkbookWriter:
             parts.append(border_desc)
         return ", ".join(parts)
 
+    def get_cached_style_description(self, cell):
+        if not cell.has_style:
+            return None
+        desc = self.style_descriptions.get(cell.style_id)
+        if desc is None:
+            desc = self.get_style_description(cell)
+            self.style_descriptions[cell.style_id] = desc
+        return desc
+
     def get_sheet_description(self, sheet):
         sheet_desc = "Sheet '" + sheet.title + "' - " + str(sheet.max_row) + " rows " + str(sheet.max_column) + " columns"
         if sheet.sheet_properties.tabColor:
@@ -112,14 +127,120 @@ class WorkbookWriter:
             print(formatter)
             if not body_rows:
                 print()
-                
+        self.write_style_legend()
+
+    def write_style_legend(self):
         for style_id, cell in self.style_cells.items():
             print("*" * style_id, self.get_style_description(cell))
             print()
-   
+
+
+class WorkbookDiffWriter(WorkbookWriter):
+    """ Writes only the rows that differ from a baseline workbook, plus a few unchanged rows around them.
+    Sheets are compared row by row as they are iterated, so the amount of text formatted depends on the size of the change """
+    def __init__(self, baseline_fn, fn, context=2):
+        WorkbookWriter.__init__(self, fn)
+        self.baseline = WorkbookWriter(baseline_fn)
+        self.context = context
+
+    def get_row_key(self, writer, row):
+        key = [ (cell.value, writer.get_cached_style_description(cell)) for cell in row ]
+        while key and key[-1] == (None, None):
+            key.pop()
+        return key
+
+    def get_context_row(self, row_ix, row):
+        return [ " " + str(row_ix) ] + [ self.get_cell_text(cell) for cell in row ]
+
+    def get_changed_rows(self, row_ix, row, old_row, style_changes):
+        rows = []
+        if old_row:
+            rows.append([ "-" + str(row_ix) ] + [ self.baseline.get_value_text(cell) for cell in old_row ])
+        if row:
+            rows.append([ "+" + str(row_ix) ] + [ self.get_cell_text(cell) for cell in row ])
+        for cell, old_cell in zip_longest(row, old_row):
+            old_desc = self.baseline.get_cached_style_description(old_cell) if old_cell is not None else None
+            new_desc = self.get_cached_style_description(cell) if cell is not None else None
+            if old_desc != new_desc:
+                coordinate = cell.coordinate if cell is not None else old_cell.coordinate
+                style_changes.append(coordinate + ": " + (old_desc or "no style") + " -> " + (new_desc or "no style"))
+        return rows
+
+    def write(self):
+        baseline_sheets = { sheet.title: sheet for sheet in self.baseline.workbook.worksheets }
+        for sheet in self.workbook.worksheets:
+            self.write_sheet_diff(sheet, baseline_sheets.pop(sheet.title, None))
+        for sheet in baseline_sheets.values():
+            print("Sheet '" + sheet.title + "' removed")
+            print()
+        self.write_style_legend()
+
+    def write_sheet_diff(self, sheet, baseline_sheet):
+        print(self.get_sheet_description(sheet))
+        header_rows, body_rows, style_changes = [], [], []
+        pending_context = deque(maxlen=self.context)
+        trailing_context = 0
+        last_row_shown = 1
+        old_rows = baseline_sheet.iter_rows() if baseline_sheet is not None else ()
+        row_ix = 0
+        has_changes = False
+        for row_ix, (row, old_row) in enumerate(zip_longest(sheet.iter_rows(), old_rows, fillvalue=()), start=1):
+            changed = self.get_row_key(self, row) != self.get_row_key(self.baseline, old_row)
+            if row_ix == 1:
+                # Always show the first row, as a header giving the changes some context
+                if changed:
+                    header_rows = self.get_changed_rows(row_ix, row, old_row, style_changes)
+                else:
+                    header_rows = [ self.get_context_row(row_ix, row) ]
+                has_changes = changed
+            elif changed:
+                first_context_ix = row_ix - len(pending_context)
+                if first_context_ix > last_row_shown + 1:
+                    body_rows.append([ "..." ])
+                for context_ix, context_row in pending_context:
+                    body_rows.append(self.get_context_row(context_ix, context_row))
+                pending_context.clear()
+                body_rows += self.get_changed_rows(row_ix, row, old_row, style_changes)
+                last_row_shown = row_ix
+                trailing_context = self.context
+                has_changes = True
+            elif trailing_context:
+                body_rows.append(self.get_context_row(row_ix, row))
+                last_row_shown = row_ix
+                trailing_context -= 1
+            else:
+                pending_context.append((row_ix, row))
+
+        if not has_changes:
+            print("No changes")
+            print()
+            return
+
+        if last_row_shown < row_ix and body_rows:
+            body_rows.append([ "..." ])
+        columnCount = max((len(r) for r in header_rows + body_rows))
+        if body_rows:
+            formatter = GridFormatterWithHeader(header_rows, body_rows, columnCount)
+        else:
+            formatter = GridFormatter(header_rows, columnCount)
+        print(formatter)
+        for style_change in style_changes:
+            print("Style changed in", style_change)
+        print()
+
+
 def main_cli():
-    last_file = max(sorted(sys.argv[1:]))
-    writer = WorkbookWriter(last_file)
+    import argparse # not needed when used as a library
+    parser = argparse.ArgumentParser(description='Program to write Excel workbooks as ASCII art, suitable for e.g. TextTest testing')
+    parser.add_argument('--baseline', help='Workbook to compare against. Only rows that differ from it are written, with some unchanged rows for context')
+    parser.add_argument('--context', type=int, default=2, help='Number of unchanged rows to show around each change when using --baseline')
+    parser.add_argument('filenames', nargs="+")
+    args = parser.parse_args()
+    last_file = max(sorted(args.filenames))
+    if args.baseline:
+        writer = WorkbookDiffWriter(args.baseline, last_file, args.context)
+    else:
+        writer = WorkbookWriter(last_file)
     writer.write()
                 
 if __name__ == '__main__':
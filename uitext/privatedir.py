@@ -0,0 +1,24 @@
+""" Per-user directory for sockets and caches, so other users on the machine can't put their own files in their place.
+    Kept free of heavy imports, as html2ascii-client uses it """
+
+import os, stat, tempfile, getpass
+
+def get_user_name():
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError): # e.g. in containers running as a uid with no passwd entry
+        return str(os.getuid()) if hasattr(os, "getuid") else "unknown"
+
+def get_private_dir():
+    """ A directory in the temporary directory that only the current user can use, created if need be.
+    Raises PermissionError if it exists but someone else could have put things in it """
+    dirName = os.path.join(tempfile.gettempdir(), "uitext-" + get_user_name())
+    try:
+        os.mkdir(dirName, 0o700)
+    except FileExistsError:
+        pass
+    if hasattr(os, "getuid"): # Windows gives each user their own temporary directory anyway
+        info = os.lstat(dirName)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise PermissionError("Not using " + dirName + ": it should be a directory only you can access")
+    return dirName
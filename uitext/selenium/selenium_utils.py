@@ -8,10 +8,24 @@ from selenium.common.exceptions import WebDriverException, StaleElementReference
 from selenium.webdriver.common.by import By as SeleniumBy
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.action_chains import ActionChains
-
-import os, sys, time
+from selenium.webdriver.chromium.remote_connection import ChromiumRemoteConnection
+from selenium.webdriver.remote.webdriver import WebDriver as RemoteWebDriver
+try:
+    from selenium.webdriver.common.driver_finder import DriverFinder
+except ImportError: # internal to Selenium and only in recent versions, without it Selenium finds the paths each time
+    DriverFinder = None
+
+import os, sys, time, atexit, threading, queue, base64, json, random, copy
 import shlex
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
 from datetime import datetime
+from urllib.parse import urlsplit
+from . import session_broker
+from ..privatedir import get_private_dir
 
 driver = None
 orig_url = None
@@ -23,22 +37,13 @@ class By(SeleniumBy):
     TEST_ID = "test id"
 
 add_explicit_display_tags = False
+# Write open shadow roots into captured pages as <template shadowrootmode>, which html2ascii flattens
+serialize_shadow_roots = False
+# Lease a warm Chrome session from a running uitext-session-broker instead of starting one, if there is one idle
+use_session_pool = False
+leased_session = None
 wait_timeout = 30
 
-def run_with_usecase(url, **kw):
-    setup(url, **kw)
-    run_usecase()
-
-
-def run_usecase():
-    if os.path.isfile("usecase.py"):
-        try:
-            exec(compile(open("usecase.py").read(), "usecase.py", 'exec'))
-        except Exception:
-            capture_all_text("termination")
-            close()
-            raise
-
 def get_downloads_dir():
     sandbox = os.getenv("TEXTTEST_SANDBOX")
     if sandbox:
@@ -47,14 +52,6 @@ def get_downloads_dir():
             os.mkdir(downloadsDir)
         return downloadsDir
 
-def setup(url, **kw):
-    set_original_url(url, **kw)
-    navigate(url)
-
-def create_driver():    
-    # chrome is default - we can fetch the logs which leads to better testing
-    create_chrome_driver()
-    
 def add_chromium_default_download(options, downloadsDir):
     prefs = { "download.default_directory": downloadsDir,
               "download.prompt_for_download": False,
@@ -80,120 +77,111 @@ def add_chromium_screen_options(options, delay):
         options.add_argument('--window-position=-2400,-2400')
         options.add_argument('--headless=new')
 
-def create_driver_object_and_retry(clsName, options):
-    global driver
-    attempts = 5
-    for attempt in range(attempts):
+def get_chrome_config():
+    # The settings create_chrome_driver starts Chrome with that tests can vary, which browsers leased from the session broker must share
+    return { "lang": os.getenv("USECASE_UI_LANGUAGE") or None, "screenSize": os.getenv("USECASE_SCREEN_SIZE") or "1920,1080",
+             "allowInsecureContent": allow_insecure_content }
+
+# Where Selenium Manager found each driver and browser, shared by all tests run by this user.
+# By default in a directory only they can write to, as the paths found are run
+driver_paths_file = None
+driver_services = { webdriver.Chrome: webdriver.ChromeService, webdriver.Firefox: webdriver.FirefoxService, webdriver.Edge: webdriver.EdgeService }
+
+@contextmanager
+def file_lock(fn):
+    with open(fn, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
         try:
-            driver = clsName(options=options)
-            return
-        except (OSError, WebDriverException):
-            # This automatically downloads the relevant driver in a given place
-            # So if two tests do this simultaneously they might clash
-            # wait a bit and try again.
-            if attempt == attempts - 1:
-                raise
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
             else:
-                time.sleep(1)
-        
-def create_chrome_driver():    
-    options = webdriver.ChromeOptions()
-    options.accept_insecure_certs = True
-    options.add_argument("--disable-search-engine-choice-screen")
-    if allow_insecure_content:
-        options.add_argument("--allow-running-insecure-content")
-    browser_lang = os.getenv("USECASE_UI_LANGUAGE")
-    if browser_lang:
-        options.add_argument("--lang=" + browser_lang)
-    # if files get downloaded, make sure they get downloaded locally
-    downloadsDir = get_downloads_dir()
-    if downloadsDir:
-        add_chromium_default_download(options, downloadsDir)
-    add_chromium_screen_options(options, delay)
-    
-    options.set_capability('goog:loggingPrefs', {'browser':'ALL'})
-    create_driver_object_and_retry(webdriver.Chrome, options)
-    enable_clipboard_permissions()
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
 
-        
-def create_firefox_driver():
-    options = webdriver.FirefoxOptions()
-    if allow_insecure_content:
-        options.set_preference("security.mixed_content.block_active_content", False)
-        options.set_preference("security.mixed_content.block_display_content", True)
-    downloadsDir = get_downloads_dir()
-    if downloadsDir:
-        options.set_preference("browser.download.folderList", 2)
-        options.set_preference("browser.download.manager.showWhenStarting", False)
-        options.set_preference("browser.download.dir", downloadsDir)
-        options.set_preference("browser.helperApps.neverAsk.saveToDisk", "application/x-gzip")
-    if not delay:
-        screen_size = os.getenv("USECASE_SCREEN_SIZE", "1920,1080")
-        width, height = screen_size.split(",")
-        options.headless = True
-        options.add_argument("--width=" + width)
-        options.add_argument("--height=" + height)
-    create_driver_object_and_retry(webdriver.Firefox, options)
-
-def enable_clipboard_permissions():
-    driver.execute_cdp_cmd(
-        cmd="Browser.grantPermissions",
-        cmd_args={
-            'permissions': ['clipboardReadWrite']
-        }
-    )
-        
-def create_edge_driver():
-    options = webdriver.EdgeOptions()
-    options.use_chromium = True
-    options.accept_insecure_certs = True
-    if allow_insecure_content:
-        options.add_argument("--allow-running-insecure-content")
-    
-    downloadsDir = get_downloads_dir()
-    if downloadsDir:
-        add_chromium_default_download(options, downloadsDir)
-    add_chromium_screen_options(options, delay)
-    options.set_capability('ms:loggingPrefs', {'browser':'ALL'})
-    create_driver_object_and_retry(webdriver.Edge, options)
-
-def get_from_session_storage(key):
-    return driver.execute_script("return sessionStorage.getItem('" + key + "');")
-    
-def add_to_session_storage(key, value):
-    driver.execute_script("sessionStorage.setItem('" + key + "', '" + value.replace("'", "\\'") + "');")
+def get_driver_paths_file():
+    return driver_paths_file or os.path.join(get_private_dir(), "driver-paths.json")
 
-def add_capturemock_cookie(value):
-    if orig_url and not driver.current_url.startswith(orig_url):
-        navigate("/favicon.ico") # somewhere so we can set cookies
-  
-    driver.add_cookie({"name": "capturemock_proxy_target", "value" : value })
-
-def set_original_url(url, browser="chrome"):
-    if browser == "firefox":
-        create_firefox_driver()
-    elif browser == "edge":
-        create_edge_driver()
-    else:
-        create_chrome_driver()
-    global orig_url
-    orig_url = url
-    # Any warning logs that get written before we navigate to the page under test should by definition not affect the test!
-    fetch_logs(serious_only=True, serious_level='ERROR')
+def read_driver_paths(fn):
+    try:
+        with open(fn) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_driver_paths(fn, cache):
+    tmpFn = fn + "." + str(os.getpid())
+    with open(tmpFn, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmpFn, fn)
+
+def get_driver_paths_key(clsName, options):
+    return " ".join((clsName.__name__, str(options.browser_version or ""), getattr(options, "binary_location", "") or ""))
+
+def find_driver_paths(clsName, options, key):
+    """ The driver and browser paths for the given options. Finding them may download them, so only one test process
+    does it at a time, and the others use what it found """
+    try:
+        fn = get_driver_paths_file()
+    except OSError as e:
+        sys.stderr.write(str(e) + ", so not sharing driver paths with other tests\n")
+        return resolve_driver_paths(clsName, options)
+    with file_lock(fn + ".lock"):
+        cache = read_driver_paths(fn)
+        paths = cache.get(key)
+        if paths and all((os.path.isfile(path) for path in paths if path)):
+            return paths
+        paths = resolve_driver_paths(clsName, options)
+        if paths[0]:
+            cache[key] = paths
+            write_driver_paths(fn, cache)
+        return paths
+
+def resolve_driver_paths(clsName, options):
+    """ The driver and browser paths, or None for each if Selenium should find them itself when creating the driver """
+    if DriverFinder is None:
+        return None, None
+    try:
+        finder = DriverFinder(driver_services[clsName](), options)
+        return finder.get_driver_path(), finder.get_browser_path()
+    except Exception as e:
+        # DriverFinder's interface has changed between Selenium versions, and may do so again
+        sys.stderr.write("Could not find the driver paths in advance, so not sharing them with other tests: " + str(e) + "\n")
+        return None, None
+
+def forget_driver_paths(key):
+    fn = get_driver_paths_file()
+    with file_lock(fn + ".lock"):
+        cache = read_driver_paths(fn)
+        if cache.pop(key, None):
+            write_driver_paths(fn, cache)
+
+def get_backoff_delay(attempt, base=0.25, limit=8):
+    # "full jitter", so tests that failed together don't all try again together
+    return random.uniform(0, min(limit, base * 2 ** attempt))
+
+class LeasedChromeDriver(webdriver.Chrome):
+    """ Attaches to a session started by the session broker, which stays running when we're done with it """
+    def __init__(self, executorUrl, sessionId):
+        self.service = None
+        self.leasedSessionId = sessionId
+        executor = ChromiumRemoteConnection(executorUrl, vendor_prefix="goog", browser_name="chrome")
+        RemoteWebDriver.__init__(self, command_executor=executor, options=webdriver.ChromeOptions())
+
+    def start_session(self, capabilities):
+        self.session_id = self.leasedSessionId
+        self.caps = { "browserName": "chrome" }
+
+def get_origin(url):
+    parts = urlsplit(url)
+    return parts.scheme + "://" + parts.netloc
 
-    
-def navigate(url):
-    if not url.startswith("http"):
-        url = orig_url + url
-    driver.get(url)
-    
-def back(ajax=False):
-    tick()
-    driver.back()
-    if ajax:
-        wait_for_ajax()
-    capture_all_text("afterback_page")
-    
 def get_next_fn(fn):
     countText = fn[-13:-10]
     if countText == "2nd":
@@ -209,8 +197,6 @@ def get_next_fn(fn):
 def test_id_xpath(test_id):
     return "//*[@" + test_id_key + "='" + test_id + "']"
 
-def find_element_by_test_id(test_id):
-    return driver.find_element(By.XPATH, test_id_xpath(test_id))
 
 def make_selector(by, value):
     if by == By.TEST_ID:
@@ -218,58 +204,6 @@ def make_selector(by, value):
     else:
         return by, value  
 
-def find_element(by, value):
-    return driver.find_element(*make_selector(by, value))
-
-def find_elements(by, value):
-    return driver.find_elements(*make_selector(by, value))
-
-def enter_text(by, value, text, replace=False, enter=False):
-    textfield = find_element(by, value)
-    change_text_in_field(textfield, text, replace=replace, enter=enter)
-
-def clear_text_field(textfield):
-    textfield.send_keys(Keys.CONTROL, "a")
-    textfield.send_keys(Keys.DELETE)
-    # Seems to fail sometimes on Edge/Linux. Fix it up.
-    if driver.capabilities['browserName'] == "msedge":
-        for i in range(5):
-            if len(textfield.get_attribute("value")) > 0:
-                textfield.send_keys(Keys.CONTROL, "a")
-                textfield.send_keys(Keys.DELETE)
-                if i == 4:
-                    raise WebDriverException("Failed to clear text field after 5 attempts!")
-                else:
-                    time.sleep(0.5)
-            else:
-                return
-    
-def change_text_in_field(textfield, text, replace=False, tab=False, enter=False):
-    if delay:
-        time.sleep(delay)
-    if replace:
-        clear_text_field(textfield)
-    if text:
-        textfield.send_keys(text)
-    if tab:
-        textfield.send_keys(Keys.TAB)
-    if enter:
-        textfield.send_keys(Keys.ENTER)
-        
-def replace_text_at_cursor(text, enter=False):
-    activeElement = driver.switch_to.active_element
-    change_text_in_field(activeElement, text, replace=True, enter=enter)
-
-def enter_text_at_cursor(text, tab=False, enter=False):
-    activeElement = driver.switch_to.active_element
-    change_text_in_field(activeElement, text, tab=tab, enter=enter)
-
-def fill_in_form(*texts):
-    for i, text in enumerate(texts):
-        lastText = i == len(texts) - 1
-        enter_text_at_cursor(text, tab=not lastText, enter=lastText)
-
-
 def shared_prefix_length(text1, text2):
     for i, letter in enumerate(text1):
         if i >= len(text2) or text2[i] != letter:
@@ -286,46 +220,66 @@ def edit_text_in_field(textfield, text, enter=False):
     if enter:
         textfield.send_keys(Keys.ENTER)
 
-def find_shadow_dom_info(*selectorArgs):
-    info = []
-    if len(selectorArgs):
-        for element in driver.find_elements(*make_selector(*selectorArgs)):
-            content = find_shadow_content(element.shadow_root)
-            info.append((element, content))
-        add_all_display_tags()
-    else:
-        for element in driver.find_elements(By.CSS_SELECTOR, "*"):
-            if add_explicit_display_tags:
-                make_display_explicit(element)
-            try:
-                shadow_root = element.shadow_root
-                content = find_shadow_content(shadow_root)
-                info.append((element, content))
-            except WebDriverException:
-                continue
-    return info
-
+# For the given shadow hosts, or all of them including those in other shadow roots, find the top-level elements
+# in each shadow root, as find_shadow_content does. Hosts come before any hosts inside them
+shadow_dom_info_js = """
+let hosts = arguments[0];
+if (!hosts) {
+    hosts = [];
+    const roots = [ document ];
+    for (let ix = 0; ix < roots.length; ix++) {
+        for (const element of roots[ix].querySelectorAll("*")) {
+            if (element.shadowRoot) {
+                hosts.push(element);
+                roots.push(element.shadowRoot);
+            }
+        }
+    }
+}
+return hosts.filter(host => host.shadowRoot).map(host => [ host, Array.from(host.shadowRoot.children).filter(element => element.localName !== "style") ]);
+"""
+
+# Same rules as make_display_explicit, for all elements matching a selector in one call instead of several per element.
+# All styles are read before any are written, as each change would make the browser recalculate them
+add_display_tags_js = """
+const selector = arguments[0];
+const roots = [ document ];
+if (arguments[1]) {
+    for (let ix = 0; ix < roots.length; ix++) {
+        for (const element of roots[ix].querySelectorAll("*")) {
+            if (element.shadowRoot) {
+                roots.push(element.shadowRoot);
+            }
+        }
+    }
+}
+const hiddenTags = new Set([ "script", "style", "head", "meta", "title", "base", "link" ]);
+const toTag = [];
+let checked = 0;
+for (const root of roots) {
+    for (const element of root.querySelectorAll(selector)) {
+        checked++;
+        const display = window.getComputedStyle(element).display;
+        const tag = element.localName;
+        if (((display === "flex" || display === "inline-block") && tag !== "span") ||
+            (display === "block" && tag !== "div") ||
+            (display === "none" && !hiddenTags.has(tag))) {
+            toTag.push([ element, display ]);
+        }
+    }
+}
+for (const [ element, display ] of toTag) {
+    element.setAttribute("data-test-explicit-display", display);
+}
+return { "checked": checked, "tagged": toTag.length };
+"""
 
-def add_all_display_tags():
-    if add_explicit_display_tags:
-        for element in driver.find_elements(By.CSS_SELECTOR, add_explicit_display_tags):
-            make_display_explicit(element)
 
 # get all 'root elements' whose parent is themselves.
 # Normal search methods don't work in Shadow DOMs...
 # Ignore styles for the shadow content, just cause clutter and can't easily be inserted
 # into the main DOM html
 
-def make_display_explicit(element):
-    try:
-        display = element.value_of_css_property("display")
-        if (display in ["flex", "inline-block"] and element.tag_name != "span") or \
-            (display == "block" and element.tag_name != "div") or \
-            (display == "none" and element.tag_name not in [ "script", "style", "head", "meta", "title", "base", "link" ]):
-            driver.execute_script("arguments[0].setAttribute('data-test-explicit-display',arguments[1])", element, display)
-    except StaleElementReferenceException:
-        # if something is stale, ignore it
-        pass
 
 def find_shadow_content(shadow_root):
     content = []
@@ -336,49 +290,175 @@ def find_shadow_content(shadow_root):
                 content.append(element)
     return content
 
-def find_text_in_dropdown(by, value, text):
-    arrowKey = Keys.DOWN
-    for _ in range(20):
-        activeElement = driver.switch_to.active_element
-        try:
-            elem = find_element(by, value)
-        except NoSuchElementException:
-            # might not be anything selected initially, press down and wait
-            activeElement.send_keys(arrowKey)
-            elem = wait_for_element(by, value)
-            
-        if elem.text == text:
-            return activeElement.send_keys(Keys.ENTER)
-        else:
-            activeElement.send_keys(arrowKey)
-    raise WebDriverException("Failed to find the text '" + text + "' in the dropdown!")
-
-
-def search_in_dropdown(by, value, text):
-    tick()
-    element = find_element(by, value)
-    element.send_keys(text)
-    element.send_keys(Keys.DOWN)
-    element.send_keys(Keys.ENTER)
-
-        
-def select_from_dropdown(by, value, text):
-    tick()
-    select = Select(find_element(by, value))
-    select.select_by_visible_text(text)
-
-def wait_until(condition, error=None, element=None, **kw):
-    try:
-        return WebDriverWait(element or driver, wait_timeout, **kw).until(condition)
-    except Exception as e:
-        print("Timed out!", error or element or driver, file=sys.stderr)
-        raise
-    
-def wait_for_element(*selectorArgs, **kw):
-    return wait_until(EC.presence_of_element_located(make_selector(*selectorArgs)), **kw)
-    
-def wait_for_visible(*selectorArgs, **kw):
-    return wait_until(EC.visibility_of_element_located(make_selector(*selectorArgs)), **kw)
+# Serializes an element with all open shadow roots inside it, in one call.
+# Uses getHTML where the browser has it, and otherwise writes the templates itself
+serialize_with_shadow_roots_js = """
+const root = arguments[0] || document.documentElement;
+const shadowRoots = [];
+const hostAncestors = new Set();
+function findShadowRoots(node) {
+    for (const element of node.querySelectorAll("*")) {
+        if (element.shadowRoot) {
+            shadowRoots.push(element.shadowRoot);
+            for (let ancestor = element; ancestor && !hostAncestors.has(ancestor); ancestor = ancestor.parentNode || ancestor.host) {
+                hostAncestors.add(ancestor);
+            }
+            findShadowRoots(element.shadowRoot);
+        }
+    }
+}
+if (root.shadowRoot) {
+    shadowRoots.push(root.shadowRoot);
+    findShadowRoots(root.shadowRoot);
+}
+findShadowRoots(root);
+if (!shadowRoots.length) {
+    return root.outerHTML;
+}
+function startTag(element) {
+    const html = element.cloneNode(false).outerHTML;
+    return html.slice(0, html.lastIndexOf("</"));
+}
+if (root.getHTML) {
+    return startTag(root) + root.getHTML({ serializableShadowRoots: true, shadowRoots: shadowRoots }) + "</" + root.localName + ">";
+}
+function serializeChildren(node) {
+    let html = "";
+    for (const child of node.childNodes) {
+        if (child.nodeType !== Node.ELEMENT_NODE) {
+            const container = document.createElement("div");
+            container.appendChild(child.cloneNode(false));
+            html += container.innerHTML;
+        } else if (hostAncestors.has(child)) {
+            html += serialize(child);
+        } else {
+            html += child.outerHTML;
+        }
+    }
+    return html;
+}
+function serialize(element) {
+    let html = startTag(element);
+    if (element.shadowRoot) {
+        html += '<template shadowrootmode="' + element.shadowRoot.mode + '">' + serializeChildren(element.shadowRoot) + "</template>";
+    }
+    return html + serializeChildren(element.content || element) + "</" + element.localName + ">";
+}
+return serialize(root);
+"""
+
+# Wait for elements by checking in the page whenever it changes, rather than asking the browser every half second
+event_driven_waits = True
+
+# Calls back with the first element found when it meets the condition, or null if it doesn't within the timeout.
+# Checks after each animation frame in which the DOM changed, and every 100ms in case only styles or layout did
+wait_in_browser_js = """
+const [ condition, using, value, text, timeout, done ] = arguments;
+function findFirst() {
+    if (using === "xpath") {
+        return document.evaluate(value, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    } else if (using === "css selector") {
+        return document.querySelector(value);
+    } else if (using === "id") {
+        return document.querySelector("#" + CSS.escape(value));
+    } else if (using === "name") {
+        return document.querySelector('[name="' + CSS.escape(value) + '"]');
+    } else if (using === "class name") {
+        return document.querySelector("." + CSS.escape(value));
+    } else {
+        return document.querySelector(value);
+    }
+}
+function hasSize(element) {
+    const rect = element.getBoundingClientRect();
+    return (rect.width > 0 && rect.height > 0) || Array.from(element.children).some(hasSize);
+}
+function isVisible(element) {
+    if (element.checkVisibility) {
+        if (!element.checkVisibility({ opacityProperty: true, visibilityProperty: true, checkOpacity: true, checkVisibilityCSS: true })) {
+            return false;
+        }
+    } else {
+        const style = window.getComputedStyle(element);
+        if (style.visibility !== "visible" || style.opacity === "0" || !element.getClientRects().length) {
+            return false;
+        }
+    }
+    return hasSize(element);
+}
+function check() {
+    if (condition === "any visible") { // as wait_for_visible_js_xpath always did
+        const results = document.evaluate(value, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        for (let ix = 0; ix < results.snapshotLength; ix++) {
+            if (results.snapshotItem(ix).checkVisibility({ checkVisibilityCSS: true })) {
+                return results.snapshotItem(ix);
+            }
+        }
+        return null;
+    }
+    const element = findFirst();
+    if (!element) {
+        return null;
+    } else if (condition === "present") {
+        return element;
+    } else if (condition === "text") {
+        return (element.innerText || element.textContent || "").toLowerCase().includes(text.toLowerCase()) ? element : null;
+    } else if (!isVisible(element)) {
+        return null;
+    } else if (condition === "visible") {
+        return element;
+    } else {
+        return element.matches(":disabled") ? null : element;
+    }
+}
+let finished = false;
+let frameRequested = false;
+const observer = new MutationObserver(() => {
+    if (!frameRequested) {
+        frameRequested = true;
+        requestAnimationFrame(() => { frameRequested = false; checkAndFinish(); });
+    }
+});
+const interval = setInterval(checkAndFinish, 100);
+const timer = setTimeout(() => finish(null), timeout);
+function finish(result) {
+    if (!finished) {
+        finished = true;
+        observer.disconnect();
+        clearInterval(interval);
+        clearTimeout(timer);
+        done(result);
+    }
+}
+function checkAndFinish() {
+    try {
+        const result = check();
+        if (result) {
+            finish(result);
+        }
+    } catch (e) {
+        finish({ error: String(e) });
+    }
+}
+observer.observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+checkAndFinish();
+"""
+# the locators wait_in_browser_js understands
+browser_wait_locators = ( By.XPATH, By.CSS_SELECTOR, By.ID, By.NAME, By.CLASS_NAME, By.TAG_NAME )
+
+def wait_in_browser(driver, condition, by, value, text=None, timeout=None):
+    """ Wait in the page until the element found is "present", "visible", "clickable" (visible and enabled), contains the
+    given "text" in any case, or for an XPath, until any element found is "any visible". Returns the element or None if
+    it timed out. Raises WebDriverException if it can't be done in the page, e.g. because the page was replaced """
+    deadline = time.monotonic() + (timeout or wait_timeout)
+    while True:
+        # in parts, to stay within the driver's script timeout
+        remaining = deadline - time.monotonic()
+        result = driver.execute_async_script(wait_in_browser_js, condition, by, value, text, int(min(remaining, 10) * 1000))
+        if isinstance(result, dict):
+            raise WebDriverException("Could not wait in the browser: " + result.get("error", ""))
+        if result is not None or remaining <= 10:
+            return result
 
 def wait_for_visible_js_xpath(driver, xpath, timeout=10):
     """
@@ -395,8 +475,19 @@ def wait_for_visible_js_xpath(driver, xpath, timeout=10):
     Raises:
         TimeoutException: If the element is not visible within the timeout period.
     """
+    start = time.monotonic()
+    if event_driven_waits:
+        try:
+            element = wait_in_browser(driver, "any visible", By.XPATH, xpath, timeout=timeout)
+            if element is None:
+                raise TimeoutException(f"Element with XPath '{xpath}' not visible on screen after {timeout} seconds.")
+            return element
+        except TimeoutException:
+            raise
+        except WebDriverException:
+            pass # wait as before for the time that's left
     try:
-        return WebDriverWait(driver, timeout).until(
+        return WebDriverWait(driver, max(timeout - (time.monotonic() - start), 0.5)).until(
             lambda d: d.execute_script("""
                 // Retrieve all elements matching the XPath
                 var xpath = arguments[0];
@@ -417,17 +508,73 @@ def wait_for_visible_js_xpath(driver, xpath, timeout=10):
         raise TimeoutException(f"Element with XPath '{xpath}' not visible on screen after {timeout} seconds.")
     
 
-def wait_for_invisible(*selectorArgs, **kw):
-    return wait_until(EC.invisibility_of_element_located(make_selector(*selectorArgs)), **kw)
-
-def wait_for_clickable(*selectorArgs, **kw):
-    return wait_until(EC.element_to_be_clickable(make_selector(*selectorArgs)), **kw)
-
-def wait_for_ajax():
-    return wait_for_background_flag("jquery.active", error="Ajax operation did not complete")
-
-def wait_for_background_flag(flag_name, error="Background operation did not complete", **kw):
-    return wait_until(lambda d: d.execute_script("return " + flag_name + " == 0"), error=error, **kw)
+# wait_and_click clicks once its element has been in the same place for this many animation frames with nothing
+# covering its centre, or after click_stable_timeout seconds regardless
+click_stable_frames = 3
+click_stable_timeout = 5
+# Where to write how long each click waited for that, e.g. sys.stderr
+click_wait_file = None
+
+# Calls back with null when the element is ready to click, or otherwise with why it isn't when the timeout is reached.
+# Scrolls it into view first if need be, as clicking it would
+wait_until_stable_js = """
+const [ element, stableFrames, timeout, done ] = arguments;
+const root = element.getRootNode().elementFromPoint ? element.getRootNode() : document;
+let lastRect = null;
+let sameFrames = 0;
+let reason = "still moving";
+let finished = false;
+const timer = setTimeout(() => finish(reason), timeout);
+function finish(result) {
+    if (!finished) {
+        finished = true;
+        clearTimeout(timer);
+        done(result);
+    }
+}
+function describe(node) {
+    return "<" + node.localName + (node.id ? " id=" + node.id : "") + (typeof node.className === "string" && node.className ? " class=" + node.className : "") + ">";
+}
+function isOver(hit) {
+    for (let node = hit; node; node = node.parentNode || node.host) {
+        if (node === element) {
+            return true;
+        }
+    }
+    return false;
+}
+function step() {
+    if (finished) {
+        return;
+    } else if (!element.isConnected) {
+        return finish(null); // clicking will say what's wrong
+    }
+    let rect = element.getBoundingClientRect();
+    let x = rect.left + rect.width / 2, y = rect.top + rect.height / 2;
+    if (lastRect === null && (x < 0 || y < 0 || x >= window.innerWidth || y >= window.innerHeight)) {
+        element.scrollIntoView({ block: "end", inline: "nearest" });
+        rect = element.getBoundingClientRect();
+        x = rect.left + rect.width / 2, y = rect.top + rect.height / 2;
+    }
+    const sameRect = lastRect !== null && rect.left === lastRect.left && rect.top === lastRect.top && rect.width === lastRect.width && rect.height === lastRect.height;
+    sameFrames = sameRect ? sameFrames + 1 : 0;
+    lastRect = rect;
+    if (sameFrames >= stableFrames) {
+        if (rect.width === 0 || rect.height === 0) {
+            return finish(null); // e.g. options of a closed dropdown, nothing can cover them
+        }
+        const hit = root.elementFromPoint(x, y);
+        if (isOver(hit)) {
+            return finish(null);
+        }
+        reason = hit ? "covered by " + describe(hit) : "not on the screen";
+    } else {
+        reason = "still moving";
+    }
+    requestAnimationFrame(step);
+}
+step();
+"""
 
 def case_insensitive_text_to_be_present_in_element(locator, text_):
     # copied from Selenium. Can be useful not to worry about case, as this is often determined by styling
@@ -440,304 +587,1108 @@ def case_insensitive_text_to_be_present_in_element(locator, text_):
 
     return _predicate
 
-def wait_for_case_insensitive_text(text, *selectorArgs, **kw):
-    return wait_until(case_insensitive_text_to_be_present_in_element(make_selector(*selectorArgs), text), **kw)
+def tick(factor=1):
+    if delay:
+        time.sleep(delay * factor)
+    
+capture_numbered=False
+page_number = 0
+wait_handler = None
 
-def wait_and_click(*selectorArgs, **kw):
-    attempts = 5
-    for attempt in range(attempts):
+# Write captured pages on a background thread, so the usecase only waits for the browser. See close()
+async_capture = False
+# html2ascii Options for also writing each captured page as a .txt file
+convert_captures = None
+capture_writer = None
+# "full": the browser window, "off": none, "failure": only when the usecase fails, "element": only the captured element if there is one,
+# "scaled": the browser window at screenshot_scale, which is much cheaper to encode. Only Chromium browsers can scale
+screenshot_policies = ("full", "off", "failure", "element", "scaled")
+
+def read_screenshot_settings():
+    # checked here, as a misspelt policy would otherwise mean full screenshots without anyone noticing
+    policy = os.getenv("USECASE_SCREENSHOTS", "full")
+    if policy not in screenshot_policies:
+        raise ValueError("Unknown screenshot policy '" + policy + "' in USECASE_SCREENSHOTS, should be one of " + ", ".join(screenshot_policies))
+    scale = os.getenv("USECASE_SCREENSHOT_SCALE", "0.5")
+    try:
+        value = float(scale)
+    except ValueError:
+        value = None
+    if value is None or not value > 0:
+        raise ValueError("USECASE_SCREENSHOT_SCALE should be a number greater than 0, not '" + scale + "'")
+    return policy, value
+
+screenshot_policy, screenshot_scale = read_screenshot_settings()
+# Write only a short note for captures where the page hasn't changed since the previous one, see Session._get_dom_fingerprint
+skip_unchanged_captures = False
+last_capture = None # DOM fingerprint and element
+last_capture_fn = None # the last page written in full
+
+def set_screenshot_policy(policy, scale=None):
+    global screenshot_policy, screenshot_scale
+    if policy not in screenshot_policies:
+        raise ValueError("Unknown screenshot policy '" + policy + "', should be one of " + ", ".join(screenshot_policies))
+    if scale is not None and not scale > 0:
+        raise ValueError("Screenshot scale should be greater than 0, not " + repr(scale))
+    screenshot_policy = policy
+    if scale is not None:
+        screenshot_scale = scale
+
+class CaptureWriter:
+    def __init__(self, writeCapture, dirName=None):
+        self.writeCapture = writeCapture
+        self.queue = queue.Queue()
+        # Names are given out here rather than by looking for files, which may not have been written yet
+        self.usedNames = set(( os.path.join(dirName, fn) if dirName else fn for fn in os.listdir(dirName or ".") ))
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush_at_exit)
+
+    def submit(self, fn, html, png, shadowHtml):
+        self.queue.put((fn, html, png, shadowHtml))
+
+    def get_unused_name(self, fn):
+        while fn in self.usedNames:
+            fn = get_next_fn(fn)
+        self.usedNames.add(fn)
+        self.usedNames.add(fn.replace(".html", ".png"))
+        return fn
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None: # closed
+                self.queue.task_done()
+                return
+            fn, html, png, shadowHtml = item
+            try:
+                self.writeCapture(self.get_unused_name(fn), html, png, shadowHtml)
+            except Exception as e:
+                print("FAILED to write captured page", fn, "-", str(e), file=sys.stderr)
+                if self.error is None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        # Wait for everything captured so far to be written. Raises the first failure, if there was one
+        self.queue.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def flush_at_exit(self):
+        # failures were already reported as they happened, and raising here would only add a traceback
         try:
-            element = wait_until(EC.element_to_be_clickable(make_selector(*selectorArgs)), error=repr(selectorArgs[-1]) + " not clickable", **kw)
-            time.sleep(0.5)
-            element.click()
-            return element
+            self.flush()
+        except Exception:
+            pass
+
+    def close(self):
+        # Writes everything captured so far and stops the thread. Raises the first failure, as flush does
+        self.queue.put(None)
+        self.thread.join()
+        atexit.unregister(self.flush_at_exit)
+        self.flush()
+
+# Counts changes to the DOM with a MutationObserver, which is started the first time.
+# Returns null if it wasn't running, e.g. after navigating to another page, as changes can't be known then.
+# Changes inside shadow roots, and things like scrolling and canvas drawing, are not noticed
+dom_fingerprint_js = """
+const tracker = window.__uitextDomChanges;
+if (!tracker) {
+    const newTracker = { count: 0 };
+    newTracker.observer = new MutationObserver(records => { newTracker.count += records.length; });
+    newTracker.observer.observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+    window.__uitextDomChanges = newTracker;
+    return null;
+}
+tracker.count += tracker.observer.takeRecords().length;
+return location.href + " " + tracker.count;
+"""
+
+browser_console_file = sys.stderr
+browser_console_error_file = sys.stderr
+global_error_level = 'WARNING'
+
+loglevels = { 'NOTSET':0 , 'DEBUG':10 ,'INFO': 20 , 'WARNING':30, 'ERROR':40, 'SEVERE':40, 'CRITICAL':50}
+
+
+class Session:
+    """ A browser, and the state of the usecase using it. Several sessions can be used at once, e.g. from different threads,
+    as long as they capture pages to different directories. The module-level functions of the same names use default_session """
+    def __init__(self, captureDir=None):
+        self.usecase_namespace = None
+        self.driver = None
+        self.orig_url = None
+        self.leased_session = None
+        self.page_number = 0
+        self.wait_handler = None
+        self.browser_console_file = sys.stderr
+        self.browser_console_error_file = sys.stderr
+        self.captureDir = captureDir
+        self.capture_writer = None
+        self.last_capture = None # DOM fingerprint and element
+        self.last_capture_fn = None # the last page written in full
+
+    def run_with_usecase(self, url, **kw):
+        self.setup(url, **kw)
+        self.run_usecase()
+
+    @property
+    def driver(self):
+        return self._driver
+
+    @driver.setter
+    def driver(self, driver):
+        # a usecase that closes the browser and starts another should see the new one
+        self._driver = driver
+        if self.usecase_namespace is not None:
+            self.usecase_namespace["driver"] = driver
+
+    def run_usecase(self):
+        if os.path.isfile("usecase.py"):
+            try:
+                exec(compile(open("usecase.py").read(), "usecase.py", 'exec'), self._get_usecase_namespace())
+            except Exception:
+                try:
+                    self.capture_all_text("termination", failure=True)
+                finally:
+                    self.close()
+                raise
+
+    def _get_usecase_namespace(self):
+        # The module's names, with the helpers and driver of this session rather than the default one
+        namespace = dict(globals())
+        namespace.update(((name, getattr(self, name)) for name in session_functions))
+        namespace["driver"] = self.driver
+        namespace["session"] = self
+        self.usecase_namespace = namespace
+        return namespace
+
+    def setup(self, url, **kw):
+        self.set_original_url(url, **kw)
+        self.navigate(url)
+
+    def create_driver(self):    
+        # chrome is default - we can fetch the logs which leads to better testing
+        self.create_chrome_driver()
+
+    def create_driver_object_and_retry(self, clsName, options, attempts=6):
+        key = get_driver_paths_key(clsName, options)
+        for attempt in range(attempts):
+            # the browser path found is filled in, so each attempt starts from the options we were given
+            attemptOptions = copy.deepcopy(options)
+            try:
+                driverPath, browserPath = find_driver_paths(clsName, attemptOptions, key)
+                if browserPath:
+                    attemptOptions.binary_location = browserPath
+                    attemptOptions.browser_version = None
+                self.driver = clsName(options=attemptOptions, service=driver_services[clsName](executable_path=driverPath))
+                return
+            except (OSError, WebDriverException):
+                if attempt == attempts - 1:
+                    raise
+                # the driver or browser may have been updated or removed since we found it
+                try:
+                    forget_driver_paths(key)
+                except OSError:
+                    pass # found again next time anyway, if it is still there
+                time.sleep(get_backoff_delay(attempt))
+
+    def create_chrome_driver(self):    
+        options = webdriver.ChromeOptions()
+        options.accept_insecure_certs = True
+        options.add_argument("--disable-search-engine-choice-screen")
+        if allow_insecure_content:
+            options.add_argument("--allow-running-insecure-content")
+        browser_lang = os.getenv("USECASE_UI_LANGUAGE")
+        if browser_lang:
+            options.add_argument("--lang=" + browser_lang)
+        # if files get downloaded, make sure they get downloaded locally
+        downloadsDir = get_downloads_dir()
+        if downloadsDir:
+            add_chromium_default_download(options, downloadsDir)
+        add_chromium_screen_options(options, delay)
+
+        options.set_capability('goog:loggingPrefs', {'browser':'ALL'})
+        self.create_driver_object_and_retry(webdriver.Chrome, options)
+        self.enable_clipboard_permissions()
+
+    def create_firefox_driver(self):
+        options = webdriver.FirefoxOptions()
+        if allow_insecure_content:
+            options.set_preference("security.mixed_content.block_active_content", False)
+            options.set_preference("security.mixed_content.block_display_content", True)
+        downloadsDir = get_downloads_dir()
+        if downloadsDir:
+            options.set_preference("browser.download.folderList", 2)
+            options.set_preference("browser.download.manager.showWhenStarting", False)
+            options.set_preference("browser.download.dir", downloadsDir)
+            options.set_preference("browser.helperApps.neverAsk.saveToDisk", "application/x-gzip")
+        if not delay:
+            screen_size = os.getenv("USECASE_SCREEN_SIZE", "1920,1080")
+            width, height = screen_size.split(",")
+            options.headless = True
+            options.add_argument("--width=" + width)
+            options.add_argument("--height=" + height)
+        self.create_driver_object_and_retry(webdriver.Firefox, options)
+
+    def enable_clipboard_permissions(self):
+        self.driver.execute_cdp_cmd(
+            cmd="Browser.grantPermissions",
+            cmd_args={
+                'permissions': ['clipboardReadWrite']
+            }
+        )
+
+    def create_edge_driver(self):
+        options = webdriver.EdgeOptions()
+        options.use_chromium = True
+        options.accept_insecure_certs = True
+        if allow_insecure_content:
+            options.add_argument("--allow-running-insecure-content")
+
+        downloadsDir = get_downloads_dir()
+        if downloadsDir:
+            add_chromium_default_download(options, downloadsDir)
+        add_chromium_screen_options(options, delay)
+        options.set_capability('ms:loggingPrefs', {'browser':'ALL'})
+        self.create_driver_object_and_retry(webdriver.Edge, options)
+
+    def _clear_origin_data(self, url):
+        self.driver.execute_cdp_cmd("Storage.clearDataForOrigin", { "origin": get_origin(url), "storageTypes": "all" })
+
+    def _get_visited_origins(self):
+        # Origins the current tab has shown pages or frames from, including those it was redirected through, e.g. to log in
+        urls = [ entry["url"] for entry in self.driver.execute_cdp_cmd("Page.getNavigationHistory", {})["entries"] ]
+        frames = [ self.driver.execute_cdp_cmd("Page.getFrameTree", {})["frameTree"] ]
+        while frames:
+            frame = frames.pop()
+            urls.append(frame["frame"]["url"])
+            frames += frame.get("childFrames", [])
+        return set((get_origin(url) for url in urls if url.startswith("http")))
+
+    def _lease_chrome_driver(self, url):
+        lease = session_broker.lease_session(config=get_chrome_config())
+        if lease is None:
+            return False
+        try:
+            self.driver = LeasedChromeDriver(lease["url"], lease["session"])
+            self.leased_session = lease["lease"]
+            self._reset_leased_driver(url)
+            return True
+        except Exception as e: # the session or its chromedriver died after the broker checked it
+            sys.stderr.write("Could not use browser session from session broker, starting a new one: " + str(e) + "\n")
+            session_broker.release_session(lease["lease"])
+            self.driver = None
+            self.leased_session = None
+            return False
+
+    def _reset_leased_driver(self, url):
+        # Make it look like a new browser. A fresh tab has no sessionStorage, and the data of every origin the old tabs visited is removed
+        oldHandles = self.driver.window_handles
+        origins = set([ get_origin(url) ])
+        for handle in oldHandles:
+            self.driver.switch_to.window(handle)
+            origins.update(self._get_visited_origins())
+        for cookie in self.driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]:
+            domain = cookie["domain"].lstrip(".")
+            origins.update(("https://" + domain, "http://" + domain))
+        self.driver.switch_to.new_window("tab")
+        newHandle = self.driver.current_window_handle
+        for handle in oldHandles:
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        self.driver.switch_to.window(newHandle)
+        self.driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        for origin in sorted(origins):
+            self._clear_origin_data(origin)
+        self.driver.execute_cdp_cmd("Browser.resetPermissions", {})
+        self.enable_clipboard_permissions()
+        downloadsDir = get_downloads_dir()
+        if downloadsDir:
+            self.driver.execute_cdp_cmd("Browser.setDownloadBehavior", { "behavior": "allow", "downloadPath": downloadsDir })
+        else:
+            self.driver.execute_cdp_cmd("Browser.setDownloadBehavior", { "behavior": "default" })
+
+    def _release_leased_driver(self):
+        try:
+            if self.orig_url:
+                self._clear_origin_data(self.orig_url)
+            self.driver.get("about:blank")
+        except WebDriverException:
+            pass # the broker won't reuse it if it's broken
+        session_broker.release_session(self.leased_session)
+        self.leased_session = None
+
+    def get_from_session_storage(self, key):
+        return self.driver.execute_script("return sessionStorage.getItem('" + key + "');")
+
+    def add_to_session_storage(self, key, value):
+        self.driver.execute_script("sessionStorage.setItem('" + key + "', '" + value.replace("'", "\\'") + "');")
+
+    def add_capturemock_cookie(self, value):
+        if self.orig_url and not self.driver.current_url.startswith(self.orig_url):
+            self.navigate("/favicon.ico") # somewhere so we can set cookies
+
+        self.driver.add_cookie({"name": "capturemock_proxy_target", "value" : value })
+
+    def set_original_url(self, url, browser="chrome"):
+        if browser == "firefox":
+            self.create_firefox_driver()
+        elif browser == "edge":
+            self.create_edge_driver()
+        elif not (use_session_pool and not delay and self._lease_chrome_driver(url)):
+            self.create_chrome_driver()
+        self.orig_url = url
+        # Any warning logs that get written before we navigate to the page under test should by definition not affect the test!
+        self.fetch_logs(serious_only=True, serious_level='ERROR')
+
+    def navigate(self, url):
+        if not url.startswith("http"):
+            url = self.orig_url + url
+        self.driver.get(url)
+
+    def back(self, ajax=False):
+        tick()
+        self.driver.back()
+        if ajax:
+            self.wait_for_ajax()
+        self.capture_all_text("afterback_page")
+
+    def find_element_by_test_id(self, test_id):
+        return self.driver.find_element(By.XPATH, test_id_xpath(test_id))
+
+    def find_element(self, by, value):
+        return self.driver.find_element(*make_selector(by, value))
+
+    def find_elements(self, by, value):
+        return self.driver.find_elements(*make_selector(by, value))
+
+    def enter_text(self, by, value, text, replace=False, enter=False):
+        textfield = self.find_element(by, value)
+        self.change_text_in_field(textfield, text, replace=replace, enter=enter)
+
+    def clear_text_field(self, textfield):
+        textfield.send_keys(Keys.CONTROL, "a")
+        textfield.send_keys(Keys.DELETE)
+        # Seems to fail sometimes on Edge/Linux. Fix it up.
+        if self.driver.capabilities['browserName'] == "msedge":
+            for i in range(5):
+                if len(textfield.get_attribute("value")) > 0:
+                    textfield.send_keys(Keys.CONTROL, "a")
+                    textfield.send_keys(Keys.DELETE)
+                    if i == 4:
+                        raise WebDriverException("Failed to clear text field after 5 attempts!")
+                    else:
+                        time.sleep(0.5)
+                else:
+                    return
+
+    def change_text_in_field(self, textfield, text, replace=False, tab=False, enter=False):
+        if delay:
+            time.sleep(delay)
+        if replace:
+            self.clear_text_field(textfield)
+        if text:
+            textfield.send_keys(text)
+        if tab:
+            textfield.send_keys(Keys.TAB)
+        if enter:
+            textfield.send_keys(Keys.ENTER)
+
+    def replace_text_at_cursor(self, text, enter=False):
+        activeElement = self.driver.switch_to.active_element
+        self.change_text_in_field(activeElement, text, replace=True, enter=enter)
+
+    def enter_text_at_cursor(self, text, tab=False, enter=False):
+        activeElement = self.driver.switch_to.active_element
+        self.change_text_in_field(activeElement, text, tab=tab, enter=enter)
+
+    def fill_in_form(self, *texts):
+        for i, text in enumerate(texts):
+            lastText = i == len(texts) - 1
+            self.enter_text_at_cursor(text, tab=not lastText, enter=lastText)
+
+    def find_shadow_dom_info(self, *selectorArgs):
+        if len(selectorArgs):
+            hosts = self.driver.find_elements(*make_selector(*selectorArgs))
+            info = self.driver.execute_script(shadow_dom_info_js, hosts)
+            self.add_all_display_tags()
+        else:
+            if add_explicit_display_tags:
+                self._add_display_tags("*")
+            info = self.driver.execute_script(shadow_dom_info_js, None)
+        return [ (host, content) for host, content in info ]
+
+    def _get_shadow_dom_html(self, shadow_dom_info):
+        # The HTML of each host, and of the content to replace it with
+        info = [ [ host, content ] for host, content in shadow_dom_info ]
+        return self.driver.execute_script("return arguments[0].map(([ host, content ]) => [ host.outerHTML, content.map(element => element.outerHTML).join('') ]);", info)
+
+    def add_all_display_tags(self):
+        if add_explicit_display_tags:
+            return self._add_display_tags(add_explicit_display_tags)
+
+    def _add_display_tags(self, selector):
+        # Returns how many elements were checked and tagged. Looks inside shadow roots if they will be captured
+        return self.driver.execute_script(add_display_tags_js, selector, serialize_shadow_roots)
+
+    def make_display_explicit(self, element):
+        try:
+            display = element.value_of_css_property("display")
+            if (display in ["flex", "inline-block"] and element.tag_name != "span") or \
+                (display == "block" and element.tag_name != "div") or \
+                (display == "none" and element.tag_name not in [ "script", "style", "head", "meta", "title", "base", "link" ]):
+                self.driver.execute_script("arguments[0].setAttribute('data-test-explicit-display',arguments[1])", element, display)
         except StaleElementReferenceException:
-            if attempt < attempts - 1:
-                time.sleep(0.1)
+            # if something is stale, ignore it
+            pass
+
+    def _get_html_with_shadow_roots(self, element=None):
+        return self.driver.execute_script(serialize_with_shadow_roots_js, element)
+
+    def find_text_in_dropdown(self, by, value, text):
+        arrowKey = Keys.DOWN
+        for _ in range(20):
+            activeElement = self.driver.switch_to.active_element
+            try:
+                elem = self.find_element(by, value)
+            except NoSuchElementException:
+                # might not be anything selected initially, press down and wait
+                activeElement.send_keys(arrowKey)
+                elem = self.wait_for_element(by, value)
+
+            if elem.text == text:
+                return activeElement.send_keys(Keys.ENTER)
             else:
-                raise
-        except WebDriverException as e:
-            if attempt < attempts - 1 and 'is not clickable at point' in str(e):
-                time.sleep(0.1)
+                activeElement.send_keys(arrowKey)
+        raise WebDriverException("Failed to find the text '" + text + "' in the dropdown!")
+
+    def search_in_dropdown(self, by, value, text):
+        tick()
+        element = self.find_element(by, value)
+        element.send_keys(text)
+        element.send_keys(Keys.DOWN)
+        element.send_keys(Keys.ENTER)
+
+    def select_from_dropdown(self, by, value, text):
+        tick()
+        select = Select(self.find_element(by, value))
+        select.select_by_visible_text(text)
+
+    def wait_until(self, condition, error=None, element=None, timeout=None, **kw):
+        try:
+            return WebDriverWait(element or self.driver, timeout or wait_timeout, **kw).until(condition)
+        except Exception as e:
+            print("Timed out!", error or element or self.driver, file=sys.stderr)
+            raise
+
+    def _wait_for_condition(self, condition, expectedCondition, selector, text=None, error=None, **kw):
+        """ Wait with wait_in_browser if we can, and otherwise by polling expectedCondition """
+        start = time.monotonic()
+        if event_driven_waits and not kw and selector[0] in browser_wait_locators:
+            try:
+                element = wait_in_browser(self.driver, condition, *selector, text=text)
+            except WebDriverException:
+                element = None # e.g. the page was replaced while waiting. Poll for the time that's left
             else:
-                raise
-    
-def wait_and_hover_on_element(*selectorArgs):
-    action = ActionChains(driver)
-    element = wait_for_visible(*make_selector(*selectorArgs))
-    action.move_to_element(element).perform()
-    return element
+                if element is None:
+                    print("Timed out!", error or self.driver, file=sys.stderr)
+                    raise TimeoutException("Timed out after " + str(wait_timeout) + " seconds waiting for " + repr(selector[1]))
+                return element
+            kw["timeout"] = max(wait_timeout - (time.monotonic() - start), 0.5)
+        return self.wait_until(expectedCondition, error=error, **kw)
+
+    def wait_for_element(self, *selectorArgs, **kw):
+        selector = make_selector(*selectorArgs)
+        return self._wait_for_condition("present", EC.presence_of_element_located(selector), selector, **kw)
+
+    def wait_for_visible(self, *selectorArgs, **kw):
+        selector = make_selector(*selectorArgs)
+        return self._wait_for_condition("visible", EC.visibility_of_element_located(selector), selector, **kw)
+
+    def wait_for_invisible(self, *selectorArgs, **kw):
+        return self.wait_until(EC.invisibility_of_element_located(make_selector(*selectorArgs)), **kw)
+
+    def wait_for_clickable(self, *selectorArgs, **kw):
+        selector = make_selector(*selectorArgs)
+        return self._wait_for_condition("clickable", EC.element_to_be_clickable(selector), selector, **kw)
+
+    def wait_for_ajax(self):
+        return self.wait_for_background_flag("jquery.active", error="Ajax operation did not complete")
+
+    def wait_for_background_flag(self, flag_name, error="Background operation did not complete", **kw):
+        return self.wait_until(lambda d: d.execute_script("return " + flag_name + " == 0"), error=error, **kw)
+
+    def wait_for_case_insensitive_text(self, text, *selectorArgs, **kw):
+        selector = make_selector(*selectorArgs)
+        condition = case_insensitive_text_to_be_present_in_element(selector, text)
+        return bool(self._wait_for_condition("text", condition, selector, text=text, **kw))
+
+    def wait_and_click(self, *selectorArgs, **kw):
+        attempts = 5
+        waitUntilStable = True
+        for attempt in range(attempts):
+            try:
+                element = self.wait_for_clickable(*selectorArgs, error=repr(selectorArgs[-1]) + " not clickable", **kw)
+                if waitUntilStable:
+                    # if it timed out once, it would most likely time out again on every retry
+                    waitUntilStable = self._wait_until_stable(element, repr(selectorArgs[-1])) is None
+                element.click()
+                return element
+            except StaleElementReferenceException:
+                if attempt < attempts - 1:
+                    time.sleep(0.1)
+                else:
+                    raise
+            except WebDriverException as e:
+                if attempt < attempts - 1 and 'is not clickable at point' in str(e):
+                    time.sleep(0.1)
+                else:
+                    raise
 
+    def _wait_until_stable(self, element, description):
+        """ Wait until the element has stopped moving and nothing covers it, see wait_until_stable_js """
+        start = time.monotonic()
+        try:
+            reason = self.driver.execute_async_script(wait_until_stable_js, element, click_stable_frames, int(click_stable_timeout * 1000))
+        except StaleElementReferenceException:
+            raise
+        except WebDriverException: # can't be done in the page, so give animations time as we always did
+            time.sleep(0.5)
+            reason = "waited a fixed time"
+        if click_wait_file is not None:
+            message = "Waited " + format(time.monotonic() - start, ".3f") + "s to click " + description
+            print(message + (" (" + reason + ")" if reason else ""), file=click_wait_file)
+        return reason
+
+    def wait_and_hover_on_element(self, *selectorArgs):
+        action = ActionChains(self.driver)
+        element = self.wait_for_visible(*make_selector(*selectorArgs))
+        action.move_to_element(element).perform()
+        return element
+
+    def wait_and_move_and_click_on_element(self, *selectorArgs, modifier=None):
+        """
+        Waits for an element to be visible, moves to it, and performs a click. Optionally, a modifier key can be held down during the click. Keep in mind in some pipelines the modifier key may not work as expected. Try using the JavaScript version (wait_and_click_element_js) if you encounter issues.
 
+        Parameters:
+        *selectorArgs: tuple
+            A variable length argument list used to create a selector for the element.
+        modifier: str, optional
+            A string representing the modifier key to hold down during the click (e.g., 'CONTROL', 'SHIFT', 'ALT'). Default is None.
 
-def wait_and_move_and_click_on_element(*selectorArgs, modifier=None):
-    """
-    Waits for an element to be visible, moves to it, and performs a click. Optionally, a modifier key can be held down during the click. Keep in mind in some pipelines the modifier key may not work as expected. Try using the JavaScript version (wait_and_click_element_js) if you encounter issues.
+        Returns:
+        WebElement
+            The web element that was found and clicked.
 
-    Parameters:
-    *selectorArgs: tuple
-        A variable length argument list used to create a selector for the element.
-    modifier: str, optional
-        A string representing the modifier key to hold down during the click (e.g., 'CONTROL', 'SHIFT', 'ALT'). Default is None.
+        Example:
+        wait_and_move_and_click_on_element('my-data-test-id', modifier='CONTROL')
+        """
+        action = ActionChains(self.driver)
+        element = self.wait_for_visible(*make_selector(*selectorArgs))
 
-    Returns:
-    WebElement
-        The web element that was found and clicked.
+        if modifier is not None:
+            actionChain = action.key_down(getattr(Keys, modifier))
+            actionChain = actionChain.click(element)
+            actionChain = action.key_up(getattr(Keys, modifier))
+        else:
+            actionChain = action.click(element)
 
-    Example:
-    wait_and_move_and_click_on_element('my-data-test-id', modifier='CONTROL')
-    """
-    action = ActionChains(driver)
-    element = wait_for_visible(*make_selector(*selectorArgs))
+        actionChain.perform()
+        return element
 
-    if modifier is not None:
-        actionChain = action.key_down(getattr(Keys, modifier))
-        actionChain = actionChain.click(element)
-        actionChain = action.key_up(getattr(Keys, modifier))
-    else:
-        actionChain = action.click(element)
+    def wait_and_click_element_js(self, *selectorArgs, modifier=None, useJs=False):
+        """
+        Waits for an element to be visible and performs a click using JavaScript. Optionally, a modifier key can be held down during the click.
 
-    actionChain.perform()
-    return element
+        Parameters:
+        *selectorArgs: tuple
+            A variable length argument list used to create a selector for the element.
+        modifier: str, optional
+            A string representing the modifier key to hold down during the click (e.g., 'CONTROL', 'SHIFT', 'ALT'). Default is None.
 
-def wait_and_click_element_js(*selectorArgs, modifier=None, useJs=False):
-    """
-    Waits for an element to be visible and performs a click using JavaScript. Optionally, a modifier key can be held down during the click.
+        Returns:
+        WebElement
+            The web element that was found and clicked.
 
-    Parameters:
-    *selectorArgs: tuple
-        A variable length argument list used to create a selector for the element.
-    modifier: str, optional
-        A string representing the modifier key to hold down during the click (e.g., 'CONTROL', 'SHIFT', 'ALT'). Default is None.
+        Example:
+        wait_and_click_element_js('my-data-test-id', modifier='CONTROL')
+        """
+        selector = make_selector(*selectorArgs)
+        element = self.wait_for_visible(*selector) if not useJs else wait_for_visible_js_xpath(self.driver,selector[1])
+
+        if modifier:
+            modifier = modifier.lower()
+            modifiers = {
+                'control': 'ctrlKey',
+                'ctrl': 'ctrlKey',
+                'shift': 'shiftKey',
+                'alt': 'altKey'
+            }
+            modifier_key = modifiers.get(modifier, '')
+            script = f"""
+            var element = arguments[0];
+            var event = new MouseEvent('click', {{
+                bubbles: true,
+                cancelable: true,
+                view: window,
+                {modifier_key}: true
+            }});
+            element.dispatchEvent(event);
+            """
+        else:
+            script = """
+                var element = arguments[0];
+                if (element) {
+                    var event = new MouseEvent('click', {
+                        bubbles: true,
+                        cancelable: true,
+                        view: window
+                    });
+                    element.dispatchEvent(event);
+                }
+                """
 
-    Returns:
-    WebElement
-        The web element that was found and clicked.
+        self.driver.execute_script(script, element)
+        return element
 
-    Example:
-    wait_and_click_element_js('my-data-test-id', modifier='CONTROL')
-    """
-    selector = make_selector(*selectorArgs)
-    element = wait_for_visible(*selector) if not useJs else wait_for_visible_js_xpath(driver,selector[1])
-    
-    if modifier:
-        modifier = modifier.lower()
-        modifiers = {
-            'control': 'ctrlKey',
-            'ctrl': 'ctrlKey',
-            'shift': 'shiftKey',
-            'alt': 'altKey'
-        }
-        modifier_key = modifiers.get(modifier, '')
-        script = f"""
-        var element = arguments[0];
-        var event = new MouseEvent('click', {{
-            bubbles: true,
-            cancelable: true,
-            view: window,
-            {modifier_key}: true
-        }});
-        element.dispatchEvent(event);
+    def wait_and_move_and_context_click_on_element(self, *selectorArgs):
         """
-    else:
-        script = """
-            var element = arguments[0];
-            if (element) {
-                var event = new MouseEvent('click', {
+        Waits for an element to be visible, moves to it, and performs a context click (right-click). Keep in mind in some tests the modifier key may not work as expected. Try using the JavaScript version (wait_and_click_element_js) if you encounter issues.
+
+        Parameters:
+        *selectorArgs: tuple
+            A variable length argument list used to create a selector for the element.
+
+        Returns:
+        WebElement
+            The web element that was found and right-clicked.
+
+        Example:
+        wait_and_move_and_context_click_on_element('my-data-test-id', modifier='CONTROL')
+        """
+        action = ActionChains(self.driver)
+        element = self.wait_for_visible(*make_selector(*selectorArgs))
+        action.context_click(element).perform()
+        return element
+
+    def wait_and_move_and_context_click_on_element_using_js(self, *selectorArgs):
+        """
+        Waits for an element to be visible, moves to it, and performs a context click (right-click) using JavaScript.
+
+        Parameters:
+        *selectorArgs: tuple
+            A variable length argument list used to create a selector for the element. It requires exactly 2 arguments: by and value.
+
+        Raises:
+        ValueError
+            If the number of arguments provided is not exactly 2.
+
+        Returns:
+        WebElement
+            The web element that was found and right-clicked.
+
+        Example:
+        wait_and_move_and_context_click_on_element_using_js('my-data-test-id', modifier='CONTROL')
+        """
+        if len(selectorArgs) != 2:
+            raise ValueError("wait_and_move_and_context_click_on_element requires exactly 2 arguments: by and value")
+
+        by, value = selectorArgs
+        element = self.wait_for_visible(*make_selector(by, value))
+
+        # Use JavaScript to trigger the right-click event
+        self.driver.execute_script("""
+            (function(element) {
+                console.log('Triggering right-click event on element:', element);
+
+                // Get the element's bounding rectangle
+                var rect = element.getBoundingClientRect();
+
+                // Calculate the center coordinates of the element
+                var x = rect.left + (rect.width / 2);
+                var y = rect.top + (rect.height / 2);
+
+                // Create and dispatch the contextmenu event at the center of the element
+                var event = new MouseEvent('contextmenu', {
                     bubbles: true,
                     cancelable: true,
-                    view: window
+                    view: window,
+                    clientX: x,
+                    clientY: y
                 });
                 element.dispatchEvent(event);
-            }
-            """
-    
-    driver.execute_script(script, element)
-    return element
+            })(arguments[0]);
+        """, element)
+
+    def send_keyboard(self, modifier=None, key=None):
+        action = ActionChains(self.driver)
+        if modifier != None:
+            if key == None:
+                actionChain = action.send_keys(getattr(Keys, modifier))
+            else:
+                actionChain = action.key_down(getattr(Keys, modifier))
+                actionChain = actionChain.send_keys(key)
+                actionChain = actionChain.key_up(getattr(Keys, modifier))
+        else:
+            actionChain = action.send_keys(key)
+        actionChain.perform()
 
-def wait_and_move_and_context_click_on_element(*selectorArgs):
-    """
-    Waits for an element to be visible, moves to it, and performs a context click (right-click). Keep in mind in some tests the modifier key may not work as expected. Try using the JavaScript version (wait_and_click_element_js) if you encounter issues.
+    def wait_for_checkpoint(self, checkpoint_name):
+        if self.wait_handler:
+            self.wait_handler.wait_for_checkpoint(checkpoint_name)
 
-    Parameters:
-    *selectorArgs: tuple
-        A variable length argument list used to create a selector for the element.
+    def file_is_complete_download(self, fn):
+        if self.wait_handler:
+            return self.wait_handler.file_is_complete_download(fn)
+        else:
+            return not fn.endswith(".crdownload") and not fn.endswith(".tmp")
+
+    def wait_for_download(self):
+        downloadsDir = get_downloads_dir()
+        if downloadsDir:
+            for _ in range(wait_timeout * 10):
+                files = [ fn for fn in os.listdir(downloadsDir) if self.file_is_complete_download(fn) ]
+                if len(files) > 0:
+                    return
+                else:
+                    time.sleep(0.1)
+        raise WebDriverException("No download files available after waiting " + str(wait_timeout) + " seconds")
+
+    def _take_screenshot(self, element=None, failure=False):
+        # Returns PNG data, or None if the policy says not to take one
+        if screenshot_policy == "off" or (screenshot_policy == "failure" and not failure):
+            return None
+        elif screenshot_policy == "element" and element is not None:
+            return element.screenshot_as_png
+        elif screenshot_policy == "scaled" and hasattr(self.driver, "execute_cdp_cmd"):
+            # the clip is in page coordinates, so it has to follow the scrolling to show what is visible
+            x, y, width, height = self.driver.execute_script("return [ window.scrollX, window.scrollY, window.innerWidth, window.innerHeight ];")
+            clip = { "x": x, "y": y, "width": width, "height": height, "scale": screenshot_scale }
+            return base64.b64decode(self.driver.execute_cdp_cmd("Page.captureScreenshot", { "format": "png", "clip": clip })["data"])
+        else:
+            return self.driver.get_screenshot_as_png()
 
-    Returns:
-    WebElement
-        The web element that was found and right-clicked.
+    def _write_capture(self, fn, html, png, shadowHtml):
+        # html is None for pages unchanged since the last one written
+        if html is None:
+            html = "<html><body>Unchanged since " + os.path.basename(self.last_capture_fn).rsplit(".", 1)[0] + "</body></html>"
+        else:
+            if png is not None:
+                with open(fn.replace(".html", ".png"), "wb") as f:
+                    f.write(png)
+            self.last_capture_fn = fn
+        for hostHtml, contentHtml in shadowHtml:
+            html = html.replace(hostHtml, contentHtml)
+        with open(fn, mode="w", encoding="utf-8") as f:
+            f.write(html)
+        if convert_captures is not None:
+            from ..ascii import html2ascii
+            with open(fn.replace(".html", ".txt"), mode="w", encoding="utf-8") as f:
+                f.write(html2ascii.convert(html, convert_captures) + "\n")
+
+    def capture_all_text(self, pagename="websource", element=None, shadow_dom_info=None, checkpoint=True, failure=False):
+        if delay:
+            time.sleep(delay)
+        if checkpoint:
+            self.wait_for_checkpoint(pagename)
+        fn = pagename + ".html"
+        if capture_numbered:
+            self.page_number += 1
+            fn = str(self.page_number).zfill(3) + "_" + fn
+        if self.captureDir:
+            fn = os.path.join(self.captureDir, fn)
+        if skip_unchanged_captures and not failure and self.last_capture is not None and self.last_capture[0] is not None and self.last_capture == (self._get_dom_fingerprint(), element):
+            html, png, shadowHtml = None, None, []
+        else:
+            png = self._take_screenshot(element, failure)
+            if add_explicit_display_tags and not shadow_dom_info:
+                self.add_all_display_tags()
+            if serialize_shadow_roots and not shadow_dom_info:
+                html = self._get_html_with_shadow_roots(element)
+            else:
+                html = element.get_attribute("outerHTML") if element else self.driver.page_source
+            shadowHtml = self._get_shadow_dom_html(shadow_dom_info) if shadow_dom_info else []
+            # Taken afterwards, as capturing can add display tags
+            self.last_capture = (self._get_dom_fingerprint(), element) if skip_unchanged_captures else None
+        if async_capture:
+            if self.capture_writer is None:
+                self.capture_writer = CaptureWriter(self._write_capture, self.captureDir)
+            self.capture_writer.submit(fn, html, png, shadowHtml)
+        else:
+            while os.path.isfile(fn):
+                fn = get_next_fn(fn)
+            self._write_capture(fn, html, png, shadowHtml)
+
+    def _get_dom_fingerprint(self):
+        return self.driver.execute_script(dom_fingerprint_js)
+
+    def flush_captures(self):
+        if self.capture_writer is not None:
+            self.capture_writer.flush()
+
+    def _close_captures(self):
+        if self.capture_writer is not None:
+            writer, self.capture_writer = self.capture_writer, None
+            writer.close()
+
+    def fetch_logs(self, serious_only, serious_level, clean_empty_browser_errors=True):
+        if isinstance(self.driver, (webdriver.Chrome, webdriver.Edge)):
+            # only chrome allows fetching browser logs
+            serious_level_number = loglevels.get(serious_level)
+            for log_type in self.driver.log_types:
+                for entry in self.driver.get_log(log_type):
+                    level = entry['level']
+                    serious = loglevels.get(level, 99) >= serious_level_number
+                    try:
+                        message = entry['message']
+                        parts = shlex.split(message)
+                        if parts[0].endswith(".js"): # temporary file reference, add as postfix
+                            message = " ".join(parts[2:])
+                            file = parts[0].rsplit("/")[-1]
+                            message += " (" + file + ":" + parts[1] + ")"
+                        message = level + ": " + message
+                        if serious:
+                            print(message, file=self.browser_console_error_file)
+                        elif not serious_only:
+                            timestampSeconds = entry["timestamp"] / 1000
+                            timestamp = datetime.fromtimestamp(timestampSeconds).isoformat()
+                            print(timestamp, message, file=self.browser_console_file)
+                    except Exception as e:
+                        print("FAILED to parse browser console message -", str(e), "\nMessage was '" + entry['message'] + "'", file=sys.stderr)
+
+        # Check if browser_console_error_file is not set to sys.stderr and delete if empty to prevent unnecessary empty browser error files.
+        if clean_empty_browser_errors and not serious_only and self.browser_console_error_file != sys.stderr:
+            file_path = self.browser_console_error_file.name
+            self.browser_console_error_file.close()
+            if os.path.exists(file_path) and os.path.getsize(file_path) == 0:
+                os.remove(file_path)
+
+    def close(self, **kw):
+        # The browser is closed even if captures couldn't be written, and the write error raised afterwards
+        try:
+            self._close_captures()
+        finally:
+            if self.driver != None:
+                try:
+                    if delay:
+                        time.sleep(delay)
+                    self.fetch_logs(serious_only=False, serious_level=global_error_level, **kw)
+                finally:
+                    if self.leased_session is not None:
+                        self._release_leased_driver()
+                    else:
+                        self.driver.quit()
+                    self.driver = None
+            else:
+                print("Couldn't close, driver == None")
+
+
+def module_global(name):
+    return property(lambda self: globals()[name], lambda self, value: globals().__setitem__(name, value))
+
+def module_function(name):
+    # The default session's helpers call each other through the module functions, as before there were sessions,
+    # so replacing one of those changes what the others do too
+    return property(lambda self: globals()[name])
+
+
+class DefaultSession(Session):
+    """ Keeps its state in the module globals, where usecases and existing code expect to find it """
+    driver = module_global("driver")
+    orig_url = module_global("orig_url")
+    leased_session = module_global("leased_session")
+    page_number = module_global("page_number")
+    wait_handler = module_global("wait_handler")
+    browser_console_file = module_global("browser_console_file")
+    browser_console_error_file = module_global("browser_console_error_file")
+    capture_writer = module_global("capture_writer")
+    last_capture = module_global("last_capture")
+    last_capture_fn = module_global("last_capture_fn")
+
+    def __init__(self):
+        # the globals already have their initial values
+        self.captureDir = None
+
+    def _get_usecase_namespace(self):
+        # the module itself, as before there were sessions, so that "global" statements and a new driver reach it
+        return globals()
+
+
+default_session = DefaultSession()
+session_functions = ("run_with_usecase", "run_usecase", "setup", "create_driver", "create_driver_object_and_retry",
+    "create_chrome_driver", "create_firefox_driver", "enable_clipboard_permissions", "create_edge_driver",
+    "get_from_session_storage", "add_to_session_storage", "add_capturemock_cookie", "set_original_url", "navigate", "back",
+    "find_element_by_test_id", "find_element", "find_elements", "enter_text", "clear_text_field", "change_text_in_field",
+    "replace_text_at_cursor", "enter_text_at_cursor", "fill_in_form", "find_shadow_dom_info", "add_all_display_tags",
+    "make_display_explicit", "find_text_in_dropdown", "search_in_dropdown", "select_from_dropdown", "wait_until",
+    "wait_for_element", "wait_for_visible", "wait_for_invisible", "wait_for_clickable", "wait_for_ajax",
+    "wait_for_background_flag", "wait_for_case_insensitive_text", "wait_and_click", "wait_and_hover_on_element",
+    "wait_and_move_and_click_on_element", "wait_and_click_element_js", "wait_and_move_and_context_click_on_element",
+    "wait_and_move_and_context_click_on_element_using_js", "send_keyboard", "wait_for_checkpoint", "file_is_complete_download",
+    "wait_for_download", "capture_all_text", "flush_captures", "fetch_logs", "close")
+
+for name in session_functions:
+    setattr(DefaultSession, name, module_function(name))
+
+# The helpers as they were before there were sessions, using the default session
 
-    Example:
-    wait_and_move_and_context_click_on_element('my-data-test-id', modifier='CONTROL')
-    """
-    action = ActionChains(driver)
-    element = wait_for_visible(*make_selector(*selectorArgs))
-    action.context_click(element).perform()
-    return element
+def run_with_usecase(url, **kw):
+    return Session.run_with_usecase(default_session, url, **kw)
 
-def wait_and_move_and_context_click_on_element_using_js(*selectorArgs):
-    """
-    Waits for an element to be visible, moves to it, and performs a context click (right-click) using JavaScript.
+def run_usecase():
+    return Session.run_usecase(default_session)
 
-    Parameters:
-    *selectorArgs: tuple
-        A variable length argument list used to create a selector for the element. It requires exactly 2 arguments: by and value.
+def setup(url, **kw):
+    return Session.setup(default_session, url, **kw)
 
-    Raises:
-    ValueError
-        If the number of arguments provided is not exactly 2.
+def create_driver():
+    return Session.create_driver(default_session)
 
-    Returns:
-    WebElement
-        The web element that was found and right-clicked.
+def create_driver_object_and_retry(clsName, options, attempts=6):
+    return Session.create_driver_object_and_retry(default_session, clsName, options, attempts)
 
-    Example:
-    wait_and_move_and_context_click_on_element_using_js('my-data-test-id', modifier='CONTROL')
-    """
-    if len(selectorArgs) != 2:
-        raise ValueError("wait_and_move_and_context_click_on_element requires exactly 2 arguments: by and value")
-    
-    by, value = selectorArgs
-    element = wait_for_visible(*make_selector(by, value))
-    
-    # Use JavaScript to trigger the right-click event
-    driver.execute_script("""
-        (function(element) {
-            console.log('Triggering right-click event on element:', element);
-            
-            // Get the element's bounding rectangle
-            var rect = element.getBoundingClientRect();
-            
-            // Calculate the center coordinates of the element
-            var x = rect.left + (rect.width / 2);
-            var y = rect.top + (rect.height / 2);
-            
-            // Create and dispatch the contextmenu event at the center of the element
-            var event = new MouseEvent('contextmenu', {
-                bubbles: true,
-                cancelable: true,
-                view: window,
-                clientX: x,
-                clientY: y
-            });
-            element.dispatchEvent(event);
-        })(arguments[0]);
-    """, element)
+def create_chrome_driver():
+    return Session.create_chrome_driver(default_session)
+
+def create_firefox_driver():
+    return Session.create_firefox_driver(default_session)
+
+def enable_clipboard_permissions():
+    return Session.enable_clipboard_permissions(default_session)
+
+def create_edge_driver():
+    return Session.create_edge_driver(default_session)
+
+def get_from_session_storage(key):
+    return Session.get_from_session_storage(default_session, key)
+
+def add_to_session_storage(key, value):
+    return Session.add_to_session_storage(default_session, key, value)
+
+def add_capturemock_cookie(value):
+    return Session.add_capturemock_cookie(default_session, value)
+
+def set_original_url(url, browser='chrome'):
+    return Session.set_original_url(default_session, url, browser)
+
+def navigate(url):
+    return Session.navigate(default_session, url)
+
+def back(ajax=False):
+    return Session.back(default_session, ajax)
+
+def find_element_by_test_id(test_id):
+    return Session.find_element_by_test_id(default_session, test_id)
+
+def find_element(by, value):
+    return Session.find_element(default_session, by, value)
+
+def find_elements(by, value):
+    return Session.find_elements(default_session, by, value)
+
+def enter_text(by, value, text, replace=False, enter=False):
+    return Session.enter_text(default_session, by, value, text, replace, enter)
+
+def clear_text_field(textfield):
+    return Session.clear_text_field(default_session, textfield)
+
+def change_text_in_field(textfield, text, replace=False, tab=False, enter=False):
+    return Session.change_text_in_field(default_session, textfield, text, replace, tab, enter)
+
+def replace_text_at_cursor(text, enter=False):
+    return Session.replace_text_at_cursor(default_session, text, enter)
+
+def enter_text_at_cursor(text, tab=False, enter=False):
+    return Session.enter_text_at_cursor(default_session, text, tab, enter)
+
+def fill_in_form(*texts):
+    return Session.fill_in_form(default_session, *texts)
+
+def find_shadow_dom_info(*selectorArgs):
+    return Session.find_shadow_dom_info(default_session, *selectorArgs)
+
+def add_all_display_tags():
+    return Session.add_all_display_tags(default_session)
+
+def make_display_explicit(element):
+    return Session.make_display_explicit(default_session, element)
+
+def find_text_in_dropdown(by, value, text):
+    return Session.find_text_in_dropdown(default_session, by, value, text)
+
+def search_in_dropdown(by, value, text):
+    return Session.search_in_dropdown(default_session, by, value, text)
+
+def select_from_dropdown(by, value, text):
+    return Session.select_from_dropdown(default_session, by, value, text)
+
+def wait_until(condition, error=None, element=None, timeout=None, **kw):
+    return Session.wait_until(default_session, condition, error, element, timeout, **kw)
+
+def wait_for_element(*selectorArgs, **kw):
+    return Session.wait_for_element(default_session, *selectorArgs, **kw)
+
+def wait_for_visible(*selectorArgs, **kw):
+    return Session.wait_for_visible(default_session, *selectorArgs, **kw)
+
+def wait_for_invisible(*selectorArgs, **kw):
+    return Session.wait_for_invisible(default_session, *selectorArgs, **kw)
+
+def wait_for_clickable(*selectorArgs, **kw):
+    return Session.wait_for_clickable(default_session, *selectorArgs, **kw)
+
+def wait_for_ajax():
+    return Session.wait_for_ajax(default_session)
+
+def wait_for_background_flag(flag_name, error="Background operation did not complete", **kw):
+    return Session.wait_for_background_flag(default_session, flag_name, error, **kw)
+
+def wait_for_case_insensitive_text(text, *selectorArgs, **kw):
+    return Session.wait_for_case_insensitive_text(default_session, text, *selectorArgs, **kw)
+
+def wait_and_click(*selectorArgs, **kw):
+    return Session.wait_and_click(default_session, *selectorArgs, **kw)
+
+def wait_and_hover_on_element(*selectorArgs):
+    return Session.wait_and_hover_on_element(default_session, *selectorArgs)
+
+def wait_and_move_and_click_on_element(*selectorArgs, modifier=None):
+    return Session.wait_and_move_and_click_on_element(default_session, *selectorArgs, modifier=modifier)
+
+def wait_and_click_element_js(*selectorArgs, modifier=None, useJs=False):
+    return Session.wait_and_click_element_js(default_session, *selectorArgs, modifier=modifier, useJs=useJs)
+
+def wait_and_move_and_context_click_on_element(*selectorArgs):
+    return Session.wait_and_move_and_context_click_on_element(default_session, *selectorArgs)
+
+def wait_and_move_and_context_click_on_element_using_js(*selectorArgs):
+    return Session.wait_and_move_and_context_click_on_element_using_js(default_session, *selectorArgs)
 
 def send_keyboard(modifier=None, key=None):
-    action = ActionChains(driver)
-    if modifier != None:
-        if key == None:
-            actionChain = action.send_keys(getattr(Keys, modifier))
-        else:
-            actionChain = action.key_down(getattr(Keys, modifier))
-            actionChain = actionChain.send_keys(key)
-            actionChain = actionChain.key_up(getattr(Keys, modifier))
-    else:
-        actionChain = action.send_keys(key)
-    actionChain.perform()
+    return Session.send_keyboard(default_session, modifier, key)
 
-def tick(factor=1):
-    if delay:
-        time.sleep(delay * factor)
-    
-capture_numbered=False
-page_number = 0
-wait_handler = None
 def wait_for_checkpoint(checkpoint_name):
-    if wait_handler:
-        wait_handler.wait_for_checkpoint(checkpoint_name)
-        
+    return Session.wait_for_checkpoint(default_session, checkpoint_name)
+
 def file_is_complete_download(fn):
-    if wait_handler:
-        return wait_handler.file_is_complete_download(fn)
-    else:
-        return not fn.endswith(".crdownload") and not fn.endswith(".tmp")
+    return Session.file_is_complete_download(default_session, fn)
 
 def wait_for_download():
-    downloadsDir = get_downloads_dir()
-    if downloadsDir:
-        for _ in range(wait_timeout * 10):
-            files = [ fn for fn in os.listdir(downloadsDir) if file_is_complete_download(fn) ]
-            if len(files) > 0:
-                return
-            else:
-                time.sleep(0.1)
-    raise WebDriverException("No download files available after waiting " + str(wait_timeout) + " seconds")
-
-def capture_all_text(pagename="websource", element=None, shadow_dom_info=None, checkpoint=True):
-    if delay:
-        time.sleep(delay)
-    if checkpoint:
-        wait_for_checkpoint(pagename)
-    fn = pagename + ".html"
-    if capture_numbered:
-        global page_number
-        page_number += 1
-        fn = str(page_number).zfill(3) + "_" + fn
-    while os.path.isfile(fn):
-        fn = get_next_fn(fn)
-    driver.save_screenshot(fn.replace(".html", ".png"))
-    with open(fn, mode="w", encoding="utf-8") as f:
-        if add_explicit_display_tags and not shadow_dom_info:
-            add_all_display_tags()
-        to_write = element.get_attribute("outerHTML") if element else driver.page_source
-        if shadow_dom_info:
-            for shadow_host, shadow_content in shadow_dom_info:
-                contentHtml = ""
-                for content in shadow_content:
-                    contentHtml += content.get_attribute("outerHTML")
-                to_write = to_write.replace(shadow_host.get_attribute("outerHTML"), contentHtml)
-        f.write(to_write)
-    
-browser_console_file = sys.stderr
-browser_console_error_file = sys.stderr
-global_error_level = 'WARNING'
+    return Session.wait_for_download(default_session)
 
-loglevels = { 'NOTSET':0 , 'DEBUG':10 ,'INFO': 20 , 'WARNING':30, 'ERROR':40, 'SEVERE':40, 'CRITICAL':50}
+def capture_all_text(pagename='websource', element=None, shadow_dom_info=None, checkpoint=True, failure=False):
+    return Session.capture_all_text(default_session, pagename, element, shadow_dom_info, checkpoint, failure)
 
+def flush_captures():
+    return Session.flush_captures(default_session)
 
 def fetch_logs(serious_only, serious_level, clean_empty_browser_errors=True):
-    if isinstance(driver, (webdriver.Chrome, webdriver.Edge)):
-        # only chrome allows fetching browser logs
-        serious_level_number = loglevels.get(serious_level)
-        for log_type in driver.log_types:
-            for entry in driver.get_log(log_type):
-                level = entry['level']
-                serious = loglevels.get(level, 99) >= serious_level_number
-                try:
-                    message = entry['message']
-                    parts = shlex.split(message)
-                    if parts[0].endswith(".js"): # temporary file reference, add as postfix
-                        message = " ".join(parts[2:])
-                        file = parts[0].rsplit("/")[-1]
-                        message += " (" + file + ":" + parts[1] + ")"
-                    message = level + ": " + message
-                    if serious:
-                        print(message, file=browser_console_error_file)
-                    elif not serious_only:
-                        timestampSeconds = entry["timestamp"] / 1000
-                        timestamp = datetime.fromtimestamp(timestampSeconds).isoformat()
-                        print(timestamp, message, file=browser_console_file)
-                except Exception as e:
-                    print("FAILED to parse browser console message -", str(e), "\nMessage was '" + entry['message'] + "'", file=sys.stderr)
-
-    # Check if browser_console_error_file is not set to sys.stderr and delete if empty to prevent unnecessary empty browser error files.
-    if clean_empty_browser_errors and not serious_only and browser_console_error_file != sys.stderr:
-        file_path = browser_console_error_file.name
-        browser_console_error_file.close()
-        if os.path.exists(file_path) and os.path.getsize(file_path) == 0:
-            os.remove(file_path)
-
+    return Session.fetch_logs(default_session, serious_only, serious_level, clean_empty_browser_errors)
 
 def close(**kw):
-    global driver
-    if driver != None:
-        if delay:
-            time.sleep(delay)
-        fetch_logs(serious_only=False, serious_level=global_error_level, **kw)
-        driver.quit()
-        driver = None
-    else:
-        print("Couldn't close, driver == None")
-
+    return Session.close(default_session, **kw)
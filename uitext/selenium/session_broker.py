@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+""" Long-running process keeping a pool of warm Chrome sessions, so tests can lease one via selenium_utils
+    instead of each starting and quitting their own browser.
+    Each request is a line of JSON on a Unix socket, each response a line of JSON, as for html2ascii-server.
+    A leased session is identified by the chromedriver URL and its session id, which the test attaches to. """
+
+import sys, os, json, time, socket, argparse, socketserver, threading, itertools
+from ..privatedir import get_private_dir
+
+def get_socket_path():
+    return os.getenv("UITEXT_SESSION_BROKER") or os.path.join(get_private_dir(), "sessions.sock")
+
+def send_command(request, socketPath=None, timeout=30):
+    # Returns None if there is no broker to talk to
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socketPath or get_socket_path())
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+                return json.loads(line) if line else None
+    except (OSError, ValueError): # includes timeouts, and the broker closing the connection without answering
+        return None
+
+def lease_session(socketPath=None, config=None):
+    """ Returns a dict with the "lease" id, chromedriver "url" and "session" id, or None if no warm session is available.
+    If config is given, the broker's browsers must have been started with the same settings, see selenium_utils.get_chrome_config """
+    response = send_command({ "command": "lease", "pid": os.getpid(), "config": config }, socketPath)
+    if response and response.get("lease"):
+        return response
+
+def release_session(leaseId, socketPath=None):
+    send_command({ "command": "release", "lease": leaseId }, socketPath)
+
+
+def is_healthy(driver):
+    try:
+        return driver.execute_script("return 1") == 1
+    except Exception:
+        return False
+
+def get_executor_url(driver):
+    return driver.service.service_url
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError: # exists, but isn't ours
+        return True
+
+
+class PooledSession:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.leaseHolder = None # process id
+
+
+class SessionPool:
+    """ Keeps up to 'size' sessions created by driverFactory, idle or leased. Sessions are checked with healthCheck
+    when leased and released, and quit instead of reused once they have been leased maxUses times """
+    def __init__(self, driverFactory, size=4, maxUses=50, healthCheck=is_healthy, retryInterval=10):
+        self.driverFactory = driverFactory
+        self.size = size
+        self.maxUses = maxUses
+        self.healthCheck = healthCheck
+        self.retryInterval = retryInterval
+        self.idle = []
+        self.leased = {}
+        self.starting = 0
+        self.lastFailure = None
+        self.closed = False
+        self.leaseIds = itertools.count(1)
+        # Sessions are started in the background while leases are handled
+        self.lock = threading.Lock()
+
+    def sessions_needed(self):
+        return self.size - len(self.idle) - len(self.leased) - self.starting
+
+    def needs_filling(self):
+        if self.closed or self.sessions_needed() <= 0:
+            return False
+        return self.lastFailure is None or time.monotonic() - self.lastFailure > self.retryInterval
+
+    def fill(self):
+        """ Start sessions until there are enough. Slow, so normally called in its own thread """
+        while True:
+            with self.lock:
+                if not self.needs_filling():
+                    return
+                self.starting += 1
+            try:
+                session = PooledSession(self.driverFactory())
+            except Exception as e:
+                sys.stderr.write("Failed to start browser session: " + str(e) + "\n")
+                session = None
+            with self.lock:
+                self.starting -= 1
+                if session is None:
+                    self.lastFailure = time.monotonic()
+                    return
+                self.lastFailure = None
+                if self.closed:
+                    self.discard(session)
+                else:
+                    self.idle.append(session)
+
+    def discard(self, session):
+        try:
+            session.driver.quit()
+        except Exception:
+            pass # probably why it's being discarded
+
+    def lease(self, pid=None):
+        """ Returns a lease id and driver, or None if there are no idle sessions """
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                session = self.idle.pop(0)
+            if self.healthCheck(session.driver):
+                break
+            self.discard(session)
+        session.uses += 1
+        session.leaseHolder = pid
+        with self.lock:
+            leaseId = next(self.leaseIds)
+            self.leased[leaseId] = session
+        return leaseId, session.driver
+
+    def release(self, leaseId):
+        with self.lock:
+            session = self.leased.pop(leaseId, None)
+        if session is None:
+            return False
+        session.leaseHolder = None
+        if session.uses >= self.maxUses or not self.healthCheck(session.driver):
+            self.discard(session)
+        else:
+            with self.lock:
+                self.idle.append(session)
+        return True
+
+    def reclaim_abandoned(self):
+        # Tests that crashed or were killed never release their session, and we can't know what state they left it in
+        abandoned = [ leaseId for leaseId, session in list(self.leased.items()) if session.leaseHolder and not process_exists(session.leaseHolder) ]
+        for leaseId in abandoned:
+            with self.lock:
+                session = self.leased.pop(leaseId, None)
+            if session is not None:
+                self.discard(session)
+
+    def get_status(self):
+        with self.lock:
+            return { "idle": len(self.idle), "leased": len(self.leased), "starting": self.starting }
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            sessions = self.idle + list(self.leased.values())
+            self.idle, self.leased = [], {}
+        for session in sessions:
+            self.discard(session)
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line: # just checking whether we're running
+            return
+        response = self.server.handle_command(json.loads(line))
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class SessionBroker(socketserver.UnixStreamServer):
+    def __init__(self, socketPath, pool, config=None):
+        socketserver.UnixStreamServer.__init__(self, socketPath, BrokerHandler)
+        self.pool = pool
+        self.config = config # the settings the pool's browsers were started with
+        self.filler = None
+
+    def handle_command(self, request):
+        command = request.get("command")
+        if command == "lease":
+            # tests wanting another language or screen size start their own browser
+            config = request.get("config")
+            if config is not None and config != self.config:
+                return { "lease": None }
+            leased = self.pool.lease(request.get("pid"))
+            if leased is None:
+                return { "lease": None }
+            leaseId, driver = leased
+            return { "lease": leaseId, "url": get_executor_url(driver), "session": driver.session_id }
+        elif command == "release":
+            return { "released": self.pool.release(request.get("lease")) }
+        elif command == "status":
+            return self.pool.get_status()
+        else:
+            return { "error": "Unknown command " + repr(command) }
+
+    def service_actions(self):
+        # called between requests by serve_forever
+        self.pool.reclaim_abandoned()
+        if self.pool.needs_filling() and (self.filler is None or not self.filler.is_alive()):
+            self.filler = threading.Thread(target=self.pool.fill, daemon=True)
+            self.filler.start()
+
+
+def broker_is_running(socketPath):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socketPath)
+            return True
+        except OSError:
+            return False
+
+def create_pooled_driver():
+    from . import selenium_utils
+    # the same options as tests use when starting their own browser, headless unless USECASE_REPLAY_DELAY is set
+    session = selenium_utils.Session()
+    session.create_chrome_driver()
+    return session.driver
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Keep warm Chrome sessions for tests to lease, when selenium_utils.use_session_pool is set')
+    parser.add_argument('--socket', help='Unix socket to listen on. Default taken from UITEXT_SESSION_BROKER, or a file in a per-user directory in the temporary directory')
+    parser.add_argument('--size', type=int, default=4, help='Number of browser sessions to keep, leased or not. Default 4')
+    parser.add_argument('--max-uses', type=int, default=50, help='Start a new browser session after one has been leased this many times. Default 50')
+    args = parser.parse_args()
+    if args.socket is None:
+        try:
+            args.socket = get_socket_path()
+        except OSError as e:
+            sys.stderr.write(str(e) + "\n")
+            sys.exit(1)
+    if broker_is_running(args.socket):
+        sys.stderr.write("Session broker already running at " + args.socket + "\n")
+        sys.exit(1)
+    if os.path.exists(args.socket):
+        os.remove(args.socket) # left behind by a broker that didn't exit cleanly
+
+    from .selenium_utils import get_chrome_config
+    pool = SessionPool(create_pooled_driver, args.size, args.max_uses)
+    server = SessionBroker(args.socket, pool, get_chrome_config())
+    try:
+        server.serve_forever(poll_interval=0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        pool.close()
+
+if __name__ == '__main__':
+    main_cli()